@@ -14,10 +14,15 @@
 # limitations under the License.
 #
 
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 import marshal
 import math
+import multiprocessing
 import os
 import re
+import threading
+import time
 
 from alive_progress import alive_bar
 import fasttext
@@ -28,6 +33,10 @@ from nltk.corpus import wordnet as wn
 from nltk.corpus.reader.wordnet import WordNetCorpusReader
 import numpy as np
 import pyfreeling
+from cache import LRUCache
+from hypernyms import AncestorIndex, HypernymIndex, simulates_root_of_both
+from resources import ResourceManager
+from scores import ScoreStore
 
 
 class Lemmatizer:
@@ -67,6 +76,13 @@ class Lemmatizer:
             lemmas = [str(lemma) for lemma in lemmas]
     
     def lemmatize(self,text:str):
+        #The lemmas of the texts already seen are remembered, because the
+        # same questions and attributes are lemmatized many times
+        key = (text,self.LANG)
+        lemmas = lemmas_cache.get(key)
+        if lemmas is not None:
+            return list(lemmas)
+
         #First we remove some special characters
         # text = re.sub("_|\.|:|,|\"| etc|\(|\)|\||»|«|”|“|‘|’|[a-z-à-úïü]['’]|['’][a-z-à-úïü]"," ",text.lower())
         text = re.sub("•","·",text.lower())
@@ -89,6 +105,7 @@ class Lemmatizer:
                     lemmas.append(w.get_lemma())
             
         res = [l for l in lemmas if ((l!=".") and (l not in self.stop_words))] 
+        lemmas_cache.put(key,tuple(res))
         return res
         # return  [l for l in lemmas if ((l!=".") and (l not in stop_words))] 
 
@@ -100,34 +117,288 @@ def meanList(l:list) -> float:
 
 langs_iso_6291 = set(["en","es","zh","mn"])
 
-modelFasttext = fasttext.load_model(os.getenv('FASTTEXT_PRETRAINED_MODEL_PATH','./lid.176.bin'))
+# The models are loaded the first time they are used, or when the server starts
+# if they are defined on PRELOAD_RESOURCES (a comma separated list or "all"),
+# that is done by main so the processes of the pool do not load them
+resources = ResourceManager()
 
-scores = {}
-try:
-    scores_file = os.getenv('SCORES_MARSHAL_PATH',"./scores.marshal")
-    if os.path.isfile(scores_file):
-        f = open(scores_file,"rb")
-        scores = marshal.load(f)
-        f.close()
-except IOError:
-    scores = {}
-print(len(scores))
+# The version of the scores file that is loaded, see scores_file_version
+scores_version = None
+scores_reload_lock = threading.Lock()
 
-lemmatizer_en = Lemmatizer(LANG="en",LANG_STOPWORDS="english")
-lemmatizer_es = Lemmatizer(LANG="es",LANG_STOPWORDS="spanish")
-lemmatizer_zh = Lemmatizer(LANG="zh",LANG_STOPWORDS="chinese")
+def scores_file_version():
+    """
+    Returns the path, the modification time and the size of the scores file
+    that is loaded by load_scores, or None if there is not any.
+    """
+    for scores_file in (os.getenv('SCORES_PATH',"./scores.store"),os.getenv('SCORES_MARSHAL_PATH',"./scores.marshal")):
+        if os.path.isfile(scores_file):
+            stat = os.stat(scores_file)
+            return (scores_file,stat.st_mtime_ns,stat.st_size)
+    return None
+
+def load_scores() -> ScoreStore:
+    """
+    Load the precomputed similarity scores from the score store file, or
+    from the legacy scores marshal file if there is not a store file.
+    """
+    global scores_version
+    scores_version = scores_file_version()
+    try:
+        scores_file = os.getenv('SCORES_PATH',"./scores.store")
+        if os.path.isfile(scores_file):
+            return ScoreStore.load(scores_file)
+        scores_file = os.getenv('SCORES_MARSHAL_PATH',"./scores.marshal")
+        if os.path.isfile(scores_file):
+            f = open(scores_file,"rb")
+            scores = ScoreStore.fromDict(marshal.load(f))
+            f.close()
+            return scores
+    except IOError:
+        pass
+    return ScoreStore()
+
+def load_wordnet():
+    wn.ensure_loaded()
+    return wn
+
+def load_hypernyms() -> HypernymIndex:
+    """
+    Load the index of the hypernyms of the synsets from the file HYPERNYMS_PATH,
+    or build it from WordNet if there is not this file.
+    """
+    wordnet = resources.get("wordnet")
+    hypernyms_file = os.getenv('HYPERNYMS_PATH',"./hypernyms.index")
+    if os.path.isfile(hypernyms_file):
+        return HypernymIndex.load(hypernyms_file,simulates_root_of_both(wordnet))
+    return HypernymIndex.fromWordNet(wordnet)
+
+resources.register("fasttext",lambda: fasttext.load_model(os.getenv('FASTTEXT_PRETRAINED_MODEL_PATH','./lid.176.bin')))
+resources.register("scores",load_scores)
+resources.register("wordnet",load_wordnet)
+resources.register("hypernyms",load_hypernyms)
+# The FreeLing sessions are not thread safe, so each thread has its own lemmatizers
+resources.register("lemmatizer_en",lambda: Lemmatizer(LANG="en",LANG_STOPWORDS="english"),per_thread=True)
+resources.register("lemmatizer_es",lambda: Lemmatizer(LANG="es",LANG_STOPWORDS="spanish"),per_thread=True)
+resources.register("lemmatizer_zh",lambda: Lemmatizer(LANG="zh",LANG_STOPWORDS="chinese"),per_thread=True)
+
+def get_fasttext():
+    return resources.get("fasttext")
+
+def get_scores() -> ScoreStore:
+    return resources.get("scores")
+
+def get_hypernyms() -> HypernymIndex:
+    return resources.get("hypernyms")
+
+def reload_scores(force=False) -> bool:
+    """
+    Loads the scores file again if it has changed since it was loaded, or
+    always if force is True, and returns if it has been loaded. The new
+    scores replace the previous ones once they are loaded, so the current
+    computations finish with the previous ones. The pool of processes is
+    replaced too, by a new one whose processes have loaded the new scores.
+    """
+    with scores_reload_lock:
+        if not force and resources.is_loaded("scores") and scores_file_version() == scores_version:
+            return False
+        resources.reload("scores")
+        recycle_process_pool()
+        return True
+
+def watch_scores(interval: float) -> threading.Thread:
+    """
+    Starts a thread that checks every interval seconds if the scores file
+    has changed, and reloads it if it has changed after it was loaded.
+    """
+    def watch():
+        while True:
+            time.sleep(interval)
+            try:
+                if resources.is_loaded("scores"):
+                    reload_scores()
+            except Exception as e:
+                print("Cannot reload the scores: " + str(e))
+    thread = threading.Thread(target=watch,name="scores-watcher",daemon=True)
+    thread.start()
+    return thread
+
+# The scores computed on the fly for the pairs of synsets without a precomputed score
+similarity_cache = LRUCache(int(os.getenv('SIMILARITY_CACHE_SIZE',"100000")))
+
+# The synsets of the attributes, that are a small and almost fixed vocabulary
+attribute_synsets_cache = LRUCache(int(os.getenv('ATTRIBUTE_SYNSETS_CACHE_SIZE',"10000")))
+
+# The lemmas of the last texts and the synsets of the last lemmas
+lemmas_cache = LRUCache(int(os.getenv('LEMMAS_CACHE_SIZE',"10000")))
+lemma_synsets_cache = LRUCache(int(os.getenv('LEMMA_SYNSETS_CACHE_SIZE',"50000")))
+
+# The languages of the last texts
+languages_cache = LRUCache(int(os.getenv('LANGUAGES_CACHE_SIZE',"10000")))
+
+# The attributes registered when the server starts, indexed by the ancestors of their synsets up to
+# ATTRIBUTE_INDEX_DEPTH, where the default is the longest distance between synsets with a score
+ATTRIBUTE_INDEX_DEPTH = int(os.getenv('ATTRIBUTE_INDEX_DEPTH',"2"))
+attribute_index = None
+attribute_index_lock = threading.Lock()
+
+def get_attribute_index() -> AncestorIndex:
+    global attribute_index
+    if attribute_index is None:
+        with attribute_index_lock:
+            if attribute_index is None:
+                attribute_index = AncestorIndex(get_hypernyms(),ATTRIBUTE_INDEX_DEPTH)
+    return attribute_index
+
+def cache_stats() -> dict:
+    """Returns the size, hits, misses and evictions of each cache, to size them"""
+    return {
+        "similarities": similarity_cache.stats(),
+        "attributeSynsets": attribute_synsets_cache.stats(),
+        "lemmas": lemmas_cache.stats(),
+        "lemmaSynsets": lemma_synsets_cache.stats(),
+        "languages": languages_cache.stats()
+    }
+
+# Number of processes where the similarities of large requests are computed,
+# 0 to compute them on the calling thread
+similarity_processes = int(os.getenv('SIMILARITY_PROCESSES',"0"))
+# The minimum number of targets of sim_str_many and of synsets of synsets_similarity_matrix
+# to compute them on the pool, as the smaller ones are faster on the calling thread
+similarity_process_min_targets = int(os.getenv('SIMILARITY_PROCESS_MIN_TARGETS',"64"))
+similarity_process_min_synsets = int(os.getenv('SIMILARITY_PROCESS_MIN_SYNSETS',"256"))
+process_pool = None
+# The number of computations using each pool, that is not shut down until they end
+process_pool_users = {}
+process_pool_lock = threading.Lock()
+
+def new_process_pool() -> ProcessPoolExecutor:
+    # The processes are spawned because forking a process with threads is not safe
+    return ProcessPoolExecutor(max_workers=similarity_processes,mp_context=multiprocessing.get_context("spawn"),initializer=init_similarity_process)
+
+@contextmanager
+def process_pool_in_use():
+    """
+    Returns the pool of processes to compute the similarities, starting it
+    if it is not started yet. The pool is not shut down while it is in use,
+    even if it is replaced by recycle_process_pool.
+    """
+    global process_pool
+    with process_pool_lock:
+        if process_pool is None:
+            process_pool = new_process_pool()
+        pool = process_pool
+        process_pool_users[pool] = process_pool_users.get(pool,0) + 1
+    try:
+        yield pool
+    finally:
+        with process_pool_lock:
+            process_pool_users[pool] -= 1
+            if process_pool_users[pool] == 0:
+                del process_pool_users[pool]
+            retired = pool not in process_pool_users and pool is not process_pool
+        if retired:
+            pool.shutdown(wait=False)
+
+def recycle_process_pool():
+    """
+    Replaces the pool of processes, if it is started, by a new one with the
+    resources loaded again. The new pool is started and its processes load
+    their resources before replacing the previous one, and the previous one
+    is shut down when the computations that are using it end.
+    """
+    global process_pool
+    if process_pool is None:
+        return
+    pool = new_process_pool()
+    try:
+        # Each process runs a task after loading its resources
+        for future in [pool.submit(os.getpid) for _ in range(similarity_processes)]:
+            future.result()
+    except Exception:
+        pool.shutdown(wait=False)
+        raise
+    with process_pool_lock:
+        previous = process_pool
+        process_pool = pool
+        retired = previous is not None and previous not in process_pool_users
+    if retired:
+        previous.shutdown(wait=False)
+
+def init_similarity_process():
+    """Loads the resources of a process of the pool, defined on SIMILARITY_PROCESS_RESOURCES"""
+    resources.preload(os.getenv('SIMILARITY_PROCESS_RESOURCES',"scores,wordnet,hypernyms,lemmatizer_en"))
+
+def shards(items: list, parts: int) -> list:
+    """Splits a list on at most the given number of consecutive non empty parts"""
+    size = max(1,-(-len(items) // max(1,parts)))
+    return [items[i:i+size] for i in range(0,len(items),size)]
 
 def getLemmatizer(lang: str) -> Lemmatizer:
-    if lang=="en":
-        lemmatizer = lemmatizer_en
-    elif lang=="es":
-        lemmatizer = lemmatizer_es
-    elif lang=="zh":
-        lemmatizer = lemmatizer_zh
+    if lang=="en" or lang=="es" or lang=="zh":
+        lemmatizer = resources.get("lemmatizer_"+lang)
     else:
         lemmatizer = Lemmatizer(LANG=lang, LANG_STOPWORDS=ISO_6391_to_name(lang))
     return lemmatizer
 
+def path_score(s1, s2) -> float:
+    """
+    Computes the similarity score between two synsets, as the path similarity
+    transformed to favour the nearest synsets. If the distance cannot be
+    computed the score is 0.
+    """
+    hypernyms = get_hypernyms()
+    if s1.name() in hypernyms and s2.name() in hypernyms:
+        score = hypernyms.path_similarity(s1.name(),s2.name())
+    else:
+        score = s1.path_similarity(s2)
+    return transform_path_similarity(score)
+
+def transform_path_similarity(score) -> float:
+    """Transforms a path similarity to favour the nearest synsets, where None is 0"""
+    if score is not None:
+        score=math.log(4*score,4)**0.3
+        if isinstance(score,complex) or score==0:
+            score = 0
+    else:
+        score = 0
+    return score
+
+# The score of the synsets at each distance, that is 0 from the distance 3
+DISTANCE_SCORES = np.array([transform_path_similarity(1.0/(distance+1)) for distance in range(4)])
+
+def path_score_matrix(s1, s2) -> np.ndarray:
+    """
+    Returns the matrix with the path_score between each synset of s1 (rows)
+    and each synset of s2 (columns), computed at once with the index of the
+    hypernyms. The synsets that are not on the index are scored one by one.
+    """
+    hypernyms = get_hypernyms()
+    ids1 = hypernyms.ids([a.name() for a in s1])
+    ids2 = hypernyms.ids([i.name() for i in s2])
+    distances = hypernyms.distance_matrix(ids1,ids2)
+    scores = np.where(distances >= 0,DISTANCE_SCORES[np.clip(distances,0,len(DISTANCE_SCORES)-1)],0.0)
+    for row,column in np.argwhere((ids1 < 0).reshape(-1,1) | (ids2 < 0).reshape(1,-1)):
+        scores[row,column] = cached_path_score(s1[row],s2[column])
+    return scores
+
+# The largest score between two different synsets, which are at least at distance 1
+MAX_DISTINCT_SCORE = math.log(2,4)**0.3
+
+def cached_path_score(s1, s2) -> float:
+    """
+    Same as path_score but remembering the last scores computed, on a cache
+    keyed by the ordered pair of names of the synsets.
+    """
+    name1 = s1.name()
+    name2 = s2.name()
+    key = (name1,name2) if name1 <= name2 else (name2,name1)
+    score = similarity_cache.get(key)
+    if score is None:
+        score = path_score(s1,s2)
+        similarity_cache.put(key,score)
+    return score
+
 def fill_scores(text: str, lang: str) -> dict:
     lemmatizer = getLemmatizer(lang)
     lemmas = lemmatizer.lemmatize(text)
@@ -145,26 +416,10 @@ def fill_scores(text: str, lang: str) -> dict:
             else:
                 synsets.append(synset[0])
     lemmas = lemmas_cp.copy()
-    new_scores = {}
+    #The scores already stored are kept, and only the pairs with a new synset are computed
+    from build_scores import build_scores
     print("Compute similarity")
-    with alive_bar(len(synsets)**2,force_tty=1) as bar:
-        for i,s1 in enumerate(synsets):
-            for j,s2 in enumerate(synsets):
-                bar()
-                if j<i:
-                    continue
-                else:
-                    score = s1.path_similarity(s2)
-                    if score is not None:
-                        score=math.log(4*score,4)**0.3
-                        if isinstance(score,complex) or score==0:
-                            score = 0
-                    else:
-                        score = 0
-                    new_scores[frozenset([s1.name(),s2.name()])] = score
-    foutput = open("./scores.marshal","wb")
-    marshal.dump(new_scores,foutput)
-    foutput.close()
+    build_scores([synset.name() for synset in synsets],os.getenv('SCORES_PATH',"./scores.store"),incremental=True)
 
 def ISO_6391_to_6392(code: str) -> str:
     """
@@ -229,50 +484,85 @@ def similarity_score(s1, s2, stat = "max"):
         similarity_score(synsets1, synsets2)
         Out: 0.73333333333333339
     """
-    if len(s1) == 0 or len(s2)==0 or s1==None or s2==None:
+    if s1 is None or s2 is None or len(s1) == 0 or len(s2) == 0:
         return 0
-    list1 = []
-
-    count=0
-    # For each synset in s1
-    for a in s1:
-        list2 = []
-        for i in s2:
-            if frozenset([a.name(),i.name()]) in scores:
-                score = scores[frozenset([a.name(),i.name()])]
-                if score is not None:
-                    list2.append(score)
-                else:
-                    list2.append(0)
-            else:
-                # finds the synset in s2 with the largest similarity value
-                score = i.path_similarity(a)
-                if score is not None:
-                    score=math.log(4*score,4)**0.3
-                    if isinstance(score,complex) or score==0:
-                        score = 0
-                    list2.append(score)
-                else:
-                    #If distance cannot be computed it is set to 0
-                    list2.append(0)
-        list1.append(max(list2))
+    return aggregate_scores(np.max(similarity_matrix(s1,s2),axis=1),stat)
+
+
+def symetric_similarity_score(s1, s2, stat = "max"):
+    if s1 is None or s2 is None or len(s1) == 0 or len(s2) == 0:
+        return 0
+    sims = similarity_matrix(s1,s2)
+    return (aggregate_scores(np.max(sims,axis=1),stat) + aggregate_scores(np.max(sims,axis=0),stat)) / 2
+
+
+def similarity_matrix(s1, s2) -> np.ndarray:
+    """
+    Returns the matrix with the similarity score between each synset of s1
+    (rows) and each synset of s2 (columns).
+
+    The precomputed scores are looked up all at once by the identifiers of
+    the synsets, and only the missing pairs are computed. Repeated synsets
+    are scored only once.
+    """
+    synsets1 = {a.name():a for a in s1}
+    synsets2 = {i.name():i for i in s2}
+    names1, inverse1 = np.unique([a.name() for a in s1],return_inverse=True)
+    names2, inverse2 = np.unique([i.name() for i in s2],return_inverse=True)
+    scores = get_scores()
+    sims = scores.lookup(scores.ids(names1),scores.ids(names2))
+    missing = np.isnan(sims)
+    if missing.any():
+        rows = np.flatnonzero(missing.any(axis=1))
+        columns = np.flatnonzero(missing.any(axis=0))
+        #The synsets of s2 are the first ones, as NLTK may not simulate the root for the second one
+        computed = path_score_matrix([synsets2[name] for name in names2[columns]],[synsets1[name] for name in names1[rows]]).T
+        block = np.ix_(rows,columns)
+        sims[block] = np.where(missing[block],computed,sims[block])
+    return sims[np.ix_(inverse1.ravel(),inverse2.ravel())]
+
+
+def similarity_bound(s1, s2, stat = "max") -> float:
+    """
+    Returns an upper bound of symetric_similarity_score without computing
+    the path similarity of any pair of synsets. The precomputed scores are
+    used as they are, and the other pairs are bounded by 1 if both synsets
+    are the same and by MAX_DISTINCT_SCORE if not. As the aggregates of
+    the maxima of each synset grow with them, the bound is never lower
+    than the score, but it is only tight for the pairs that are on the
+    precomputed scores.
+    """
+    if s1 is None or s2 is None or len(s1) == 0 or len(s2) == 0:
+        return 0
+    names1, inverse1 = np.unique([a.name() for a in s1],return_inverse=True)
+    names2, inverse2 = np.unique([i.name() for i in s2],return_inverse=True)
+    scores = get_scores()
+    sims = scores.lookup(scores.ids(names1),scores.ids(names2))
+    missing = np.isnan(sims)
+    sims[missing] = np.where(names1.reshape(-1,1) == names2.reshape(1,-1),1.0,MAX_DISTINCT_SCORE)[missing]
+    sims = sims[np.ix_(inverse1.ravel(),inverse2.ravel())]
+    return (aggregate_scores(np.max(sims,axis=1),stat) + aggregate_scores(np.max(sims,axis=0),stat)) / 2
+
+
+def aggregate_scores(maxima, stat = "max", axis = None):
+    """
+    Aggregates the largest similarity values of each synset according
+    the stat argument (max, mean, q75 or q90), over all of them or over
+    an axis.
+    """
     if stat == "max":
-        output = max(list1)
+        output = np.max(maxima,axis=axis)
     elif stat == "mean":
-        output = meanList(list1)
+        output = np.mean(maxima,axis=axis)
     elif stat == "q75":
-        output = np.quantile(np.array(list1),0.75)
+        output = np.quantile(maxima,0.75,axis=axis)
     elif stat == "q90":
-        output = np.quantile(np.array(list1),0.90)
+        output = np.quantile(maxima,0.90,axis=axis)
     else:
         raise ValueError("Stat still not suported")
     return output
 
 
-def symetric_similarity_score(s1, s2, stat = "max"):
-    return (similarity_score(s1, s2,stat) + similarity_score(s2, s1,stat)) / 2
-
-
 def toks_to_synsets(toks, pos = None, lang = "eng"):
     """
     Returns a list of synsets in a list of tokens.
@@ -293,10 +583,14 @@ def toks_to_synsets(toks, pos = None, lang = "eng"):
     """
     output = []
     for i in toks:
-        syn = wn.synsets(i,pos=None,lang=lang)
-        #3 is the maximum number of synsets taken per lemma, the higher, the better
-        # coverage, however the lower speed.
-        syn = syn[0:min(3,len(syn))]
+        key = (i,lang)
+        syn = lemma_synsets_cache.get(key)
+        if syn is None:
+            syn = wn.synsets(i,pos=None,lang=lang)
+            #3 is the maximum number of synsets taken per lemma, the higher, the better
+            # coverage, however the lower speed.
+            syn = tuple(syn[0:min(3,len(syn))])
+            lemma_synsets_cache.put(key,syn)
         if len(syn)>0:
             synNames = []
             for s in syn:
@@ -331,22 +625,92 @@ def tokLists_to_synsets(tokLists, pos = None, lang="eng"):
             output.append(res)
         return output
 
-def tokLists_path_similarity(tokLists1, tokLists2, lang1="eng", lang2="eng", stat="max"):
-    """Finds the symmetrical similarity between two lists 
-    of lists of tokens (two lists of documents)"""
-            # first function u need to create
-    synsetsLists1 = tokLists_to_synsets(tokLists1,lang=lang1)
-    synsetsLists2 = tokLists_to_synsets(tokLists2,lang=lang2)
+def text_to_synsets(text: str, lang="en") -> list:
+    """
+    Returns the synsets of the lemmas of a text.
+
+    Parameters
+    ----------
+    text: str
+        Text to obtain its synsets.
+    lang: str
+        Language of the text in ISO 639-1 format.
+    """
+    lemmatizer = getLemmatizer(lang)
+    return toks_to_synsets(lemmatizer.lemmatize(text),lang=ISO_6391_to_6392(lang))
+
+pattern_camel = re.compile(r'(?<!^)(?=[A-Z])')
+pattern_word = re.compile(r'(\W|\.|_)')
 
-            # 2nd function u need to create
+def normalize_attribute(attribute:str) -> str:
+    """Convert the name of an attribute to the text to compare"""
+    normalized_attribute = pattern_camel.sub(' ',attribute).lower()
+    return pattern_word.sub(' ',normalized_attribute)
 
-    with alive_bar(len(synsetsLists1)*len(synsetsLists2),force_tty=1) as bar:
-        sims = np.full(fill_value=-1.0,shape=(len(tokLists1),len(tokLists2)))
-        for s1 in range(len(synsetsLists1)):
-            for s2 in range(len(synsetsLists2)):
-                bar()
-                sims[s1,s2] = (similarity_score(synsetsLists1[s1], synsetsLists2[s2],stat) + similarity_score(synsetsLists2[s2], synsetsLists1[s1],stat)) / 2
+def attribute_to_synsets(attribute: str, lang="en") -> list:
+    """
+    Same as text_to_synsets but remembering the synsets of the last
+    attributes, so they are lemmatized only once. The returned list
+    is shared and must not be modified.
+
+    Parameters
+    ----------
+    attribute: str
+        Normalized name of the attribute.
+    lang: str
+        Language of the attribute in ISO 639-1 format.
+    """
+    key = (attribute,lang)
+    synsets = attribute_synsets_cache.get(key)
+    if synsets is None:
+        synsets = text_to_synsets(attribute,lang)
+        attribute_synsets_cache.put(key,synsets)
+    return synsets
+
+def warm_attribute_synsets(attributes: list, lang="en"):
+    """
+    Fills the cache of synsets with the given attributes, and registers them
+    on the attribute index. The attributes that cannot be lemmatized are
+    ignored.
+    """
+    index = get_attribute_index()
+    for attribute in attributes:
+        try:
+            index.add((attribute,lang),[s.name() for s in attribute_to_synsets(attribute,lang)])
+        except Exception:
+            pass
+
+def reachable_targets(source_synsets: list, targets: list, lang_tgt="en") -> list:
+    """
+    Returns for each target if it has to be compared with the source synsets.
+    Only the registered attributes without any synset at a distance of at
+    most ATTRIBUTE_INDEX_DEPTH from the source synsets are not compared, and
+    their similarity is 0, that is exact as long as the depth is at least 2.
+    """
+    if attribute_index is None or len(attribute_index) == 0:
+        return [True]*len(targets)
+    candidates = attribute_index.candidates([s.name() for s in source_synsets])
+    if candidates is None:
+        return [True]*len(targets)
+    return [(target,lang_tgt) not in attribute_index or (target,lang_tgt) in candidates for target in targets]
+
+# The number of documents compared between the calls to the progress callbacks
+PROGRESS_BLOCK = 64
 
+def tokLists_path_similarity(tokLists1, tokLists2, lang1="eng", lang2="eng", stat="max", progress=None):
+    """Finds the symmetrical similarity between two lists 
+    of lists of tokens (two lists of documents). If progress is given
+    the documents of the first list are compared on blocks, calling it
+    with the number of pairs of documents compared after each block."""
+    synsetsLists1 = tokLists_to_synsets(tokLists1,lang=lang1)
+    synsetsLists2 = tokLists_to_synsets(tokLists2,lang=lang2)
+    if progress is None:
+        return synsetsLists_similarity_matrix(synsetsLists1,synsetsLists2,stat)
+    sims = np.zeros((len(synsetsLists1),len(synsetsLists2)))
+    for start in range(0,len(synsetsLists1),PROGRESS_BLOCK):
+        end = min(start+PROGRESS_BLOCK,len(synsetsLists1))
+        sims[start:end] = synsetsLists_similarity_matrix(synsetsLists1[start:end],synsetsLists2,stat)
+        progress((end-start)*len(synsetsLists2))
     return sims
 
 
@@ -378,6 +742,145 @@ def sim_str_str(txt1: str, txt2: str,lang1="eng",lang2="eng",stat="max") -> floa
 
 
 
+def sim_str_many(source: str, targets: list,lang_src="en",lang_tgt="en",stat="max") -> list:
+    """
+    Finds the symetric similarity score between a text and each one of some
+    other texts, aggregating the path similarity of the synsets according the
+    stat argument. The source text is lemmatized only once, and the synsets
+    of the targets are taken from the cache of attribute synsets.
+
+    Parameters
+    ----------
+    source: str
+        Text to compare with the targets.
+    targets: list
+        Texts to compare with the source.
+    lang_src: str
+        Language of the source text in ISO 639-1 format.
+    lang_tgt: str
+        Language of the targets in ISO 639-1 format.
+    stat: str
+        Statistical function to aggregate the similarity between lemmas.
+
+    Returns
+    ----------
+    The list with the similarity of each target.
+    """
+    if len(targets) == 0:
+        return []
+    source_synsets = text_to_synsets(source,lang_src)
+    reachable = reachable_targets(source_synsets,targets,lang_tgt)
+    if similarity_processes > 0 and sum(reachable) >= max(2,similarity_process_min_targets):
+        names = [s.name() for s in source_synsets]
+        compared = [target for target,reach in zip(targets,reachable) if reach]
+        with process_pool_in_use() as pool:
+            futures = [pool.submit(sim_synsets_many,names,shard,lang_tgt,stat) for shard in shards(compared,similarity_processes)]
+            sims = iter([sim for future in futures for sim in future.result()])
+        return [next(sims) if reach else 0.0 for reach in reachable]
+    return [symetric_similarity_score(source_synsets,attribute_to_synsets(target,lang_tgt),stat=stat) if reach else 0.0 for target,reach in zip(targets,reachable)]
+
+
+def sim_str_iter(source: str, targets: list,lang_src="en",lang_tgt="en",stat="max"):
+    """
+    Same as sim_str_many but yielding the similarity of each target as soon
+    as it is computed, so the first ones can be used before the last ones
+    are computed.
+
+    Parameters
+    ----------
+    source: str
+        Text to compare with the targets.
+    targets: list
+        Texts to compare with the source.
+    lang_src: str
+        Language of the source text in ISO 639-1 format.
+    lang_tgt: str
+        Language of the targets in ISO 639-1 format.
+    stat: str
+        Statistical function to aggregate the similarity between lemmas.
+
+    Returns
+    ----------
+    A generator of the similarity of each target, on the same order.
+    """
+    if len(targets) == 0:
+        return
+    source_synsets = text_to_synsets(source,lang_src)
+    for target,reach in zip(targets,reachable_targets(source_synsets,targets,lang_tgt)):
+        yield symetric_similarity_score(source_synsets,attribute_to_synsets(target,lang_tgt),stat=stat) if reach else 0.0
+
+
+def sim_str_top(source: str, targets: list,lang_src="en",lang_tgt="en",stat="max",top_k=None,min_similarity=0.0) -> list:
+    """
+    Finds the targets most similar to a text, as sim_str_many, but skipping
+    the targets whose similarity_bound is lower than min_similarity or than
+    the similarity of the last target on the result. The targets are
+    visited from the one with the highest bound, so the search stops at the
+    first one that is skipped. The registered attributes that are not
+    reachable from the source, as on reachable_targets, are bounded by 0.
+    The bound is only tight for the pairs of synsets with a precomputed
+    score, so without them only the unreachable targets are skipped. On the
+    pool of processes the targets over min_similarity are computed at once.
+
+    Parameters
+    ----------
+    source: str
+        Text to compare with the targets.
+    targets: list
+        Texts to compare with the source.
+    lang_src: str
+        Language of the source text in ISO 639-1 format.
+    lang_tgt: str
+        Language of the targets in ISO 639-1 format.
+    stat: str
+        Statistical function to aggregate the similarity between lemmas.
+    top_k: int
+        Maximum number of targets to return, or None to return all of them.
+    min_similarity: float
+        Minimum similarity of the targets to return.
+
+    Returns
+    ----------
+    The list of pairs with the index of a target and its similarity, from
+    the most similar target, and on the order of the targets on ties.
+    """
+    if len(targets) == 0 or (top_k is not None and top_k <= 0):
+        return []
+    source_synsets = text_to_synsets(source,lang_src)
+    targets_synsets = [attribute_to_synsets(target,lang_tgt) if reach else [] for target,reach in zip(targets,reachable_targets(source_synsets,targets,lang_tgt))]
+    bounds = [similarity_bound(source_synsets,synsets,stat) for synsets in targets_synsets]
+    order = [i for i in sorted(range(len(targets)),key=lambda i: -bounds[i]) if bounds[i] >= min_similarity]
+    if similarity_processes > 0 and len(order) >= max(2,similarity_process_min_targets):
+        names = [s.name() for s in source_synsets]
+        with process_pool_in_use() as pool:
+            futures = [pool.submit(sim_synsets_many,names,shard,lang_tgt,stat) for shard in shards([targets[i] for i in order],similarity_processes)]
+            sims = [sim for future in futures for sim in future.result()]
+        top = sorted([(index,sim) for index,sim in zip(order,sims) if sim >= min_similarity],key=lambda pair: (-pair[1],pair[0]))
+        return top if top_k is None else top[:top_k]
+    top = []
+    threshold = min_similarity
+    for index in order:
+        if bounds[index] < threshold:
+            break
+        sim = symetric_similarity_score(source_synsets,targets_synsets[index],stat=stat)
+        if sim >= min_similarity:
+            top.append((index,sim))
+            top.sort(key=lambda pair: (-pair[1],pair[0]))
+            if top_k is not None and len(top) >= top_k:
+                del top[top_k:]
+                threshold = max(min_similarity,top[-1][1])
+    return top
+
+
+def sim_synsets_many(names: list, targets: list,lang_tgt="en",stat="max") -> list:
+    """
+    Same as sim_str_many but for the already computed synsets of the source,
+    given by their names so they can be sent to another process.
+    """
+    source_synsets = [wn.synset(name) for name in names]
+    return [symetric_similarity_score(source_synsets,attribute_to_synsets(target,lang_tgt),stat=stat) for target in targets]
+
+
 def sim_str_str_multiling(txt1: str, txt2: str,stat="max") -> float:
     """
     Finds the symetric similarity score between two texts, where each
@@ -399,12 +902,7 @@ def sim_str_str_multiling(txt1: str, txt2: str,stat="max") -> float:
 
     """
     #We find out the language of the texts
-    lang1 = modelFasttext.predict(txt1, k=10)[0] #We take the ISO code of the languages
-    # print(lang1)
-    lang1 = next(l[-2:] for l in lang1 if l[-2:] in langs_iso_6291)
-    lang2 = modelFasttext.predict(txt2, k=10)[0]
-    # print(lang2)
-    lang2 = next(l[-2:] for l in lang2 if l[-2:] in langs_iso_6291)
+    lang1, lang2 = detect_langs([txt1,txt2])
     return sim_str_str(txt1,txt2,lang1=lang1,lang2=lang2,stat=stat)
 
 def sim_str_attrlst(txt: str, attrlst: list,lang1="eng",lang2="eng",stat="max") -> list:
@@ -434,11 +932,10 @@ def sim_str_attrlst(txt: str, attrlst: list,lang1="eng",lang2="eng",stat="max")
 
     """
     attrlst_str = [str(attr[0])+" : "+str(attr[1]) for attr in attrlst]
-    result = []
-    for i,attr in enumerate(attrlst_str):
-        sim = sim_str_str(txt,attr,lang1=lang1,lang2=lang2,stat=stat)
-        result.append((attrlst[i][0],attrlst[i][1],sim))
-    return result
+    #The text is lemmatized only once, and the pairs are not kept on the cache of attribute synsets
+    synsets = text_to_synsets(txt,lang1)
+    sims = [symetric_similarity_score(synsets,text_to_synsets(attr_str,lang2),stat=stat) for attr_str in attrlst_str]
+    return [(attr[0],attr[1],sim) for attr,sim in zip(attrlst,sims)]
 
 def sim_str_attrlst_multiling(txt: str, attrlst: list,stat="max") -> list:
     """
@@ -466,16 +963,11 @@ def sim_str_attrlst_multiling(txt: str, attrlst: list,stat="max") -> list:
 
     """
 
-    #We find out the language of the texts
-    lang1 = modelFasttext.predict(txt, k=10)[0] #We take the ISO code of the languages
-    # print(lang1)
-    lang1 = next(l[-2:] for l in lang1 if l[-2:] in langs_iso_6291)
-
     # Concatenate attributes in a string as: "key1 : value1. key2 : value2."
     attrlst_str = [str(attr[0])+" : "+str(attr[1]) for attr in attrlst]
     attr_str = ". ".join(attrlst_str)+"."
-    lang2 = modelFasttext.predict(attr_str, k=10)[0]
-    lang2 = next(l[-2:] for l in lang2 if l[-2:] in langs_iso_6291)
+    #We find out the language of the texts
+    lang1, lang2 = detect_langs([txt,attr_str])
     return sim_str_attrlst(txt,attrlst,lang1=lang1,lang2=lang2,stat=stat)
 
 def sim_attrlst_attrlst(attrlst1: list, attrlst2: list,lang1="eng",lang2="eng",stat="max") -> float:
@@ -536,17 +1028,161 @@ def sim_attrlst_attrlst_multiling(attrlst1: list, attrlst2: list,stat="max") ->
 
     # Concatenate attributes in a string as: "key1 : value1. key2 : value2."
     attrlst_str = [str(attr[0])+" : "+str(attr[1]) for attr in attrlst1]
-    attr_str = ". ".join(attrlst_str)+"."
-    lang1 = modelFasttext.predict(attr_str, k=10)[0]
-    lang1 = next(l[-2:] for l in lang1 if l[-2:] in langs_iso_6291)
+    attr_str1 = ". ".join(attrlst_str)+"."
     attrlst_str = [str(attr[0])+" : "+str(attr[1]) for attr in attrlst2]
-    attr_str = ". ".join(attrlst_str)+"."
-    lang2 = modelFasttext.predict(attr_str, k=10)[0]
-    lang2 = next(l[-2:] for l in lang2 if l[-2:] in langs_iso_6291)
+    attr_str2 = ". ".join(attrlst_str)+"."
+    lang1, lang2 = detect_langs([attr_str1,attr_str2])
     
-    sim=sim_attrlst_attrlst(attrlst1,attrlst2,lang1,lang2,stat)
-    print(sim)
-    return(sim)
+    return sim_attrlst_attrlst(attrlst1,attrlst2,lang1,lang2,stat)
+
+def sim_attrlst_matrix(attrlsts: list, langs=None, stat="max") -> np.ndarray:
+    """
+    Computes the similarity between each pair of some profiles, as
+    sim_attrlst_attrlst but lemmatizing each different attribute only once
+    and scoring each pair of different synsets only once.
+
+    Parameters
+    ----------
+    attrlsts : list
+        The profiles, each one a list of attributes (tuples <key,value>).
+    langs : list, optional
+        Language of each profile in ISO 639-1 format, by default they are detected.
+    stat : str, optional
+        Statistical function to aggregate the similarity between lemmas, by default "max".
+
+    Returns
+    -------
+    np.ndarray
+        The symmetric matrix with the affinity between each pair of profiles,
+        where the affinity of a profile without attributes is 0.
+    """
+    attrlsts_str = [[str(attr[0])+" : "+str(attr[1]) for attr in attrlst] for attrlst in attrlsts]
+    if langs is None:
+        langs = detect_langs([". ".join(attrlst_str)+"." for attrlst_str in attrlsts_str])
+    attributes = {}
+    profiles = []
+    for attrlst_str,lang in zip(attrlsts_str,langs):
+        profiles.append([attributes.setdefault((attr_str,lang),len(attributes)) for attr_str in attrlst_str])
+    synsetsLists = [toks_to_synsets(getLemmatizer(lang).lemmatize(attr_str),lang=ISO_6391_to_6392(lang)) for attr_str,lang in attributes]
+    return affinity_matrix(profiles,synsetsLists_similarity_matrix(synsetsLists,synsetsLists,stat))
+
+
+def synsetsLists_similarity_matrix(synsetsLists1: list, synsetsLists2: list, stat="max") -> np.ndarray:
+    """
+    Returns the matrix with the symetric_similarity_score between each list
+    of synsets of synsetsLists1 (rows) and each one of synsetsLists2
+    (columns), computed from the scores between all their different synsets
+    at once.
+    """
+    synsets1 = {}
+    for synsetsList in synsetsLists1:
+        for synset in synsetsList:
+            synsets1.setdefault(synset.name(),synset)
+    synsets2 = {}
+    for synsetsList in synsetsLists2:
+        for synset in synsetsList:
+            synsets2.setdefault(synset.name(),synset)
+    sims = np.zeros((len(synsetsLists1),len(synsetsLists2)))
+    nonempty1 = [i for i,synsetsList in enumerate(synsetsLists1) if len(synsetsList) > 0]
+    nonempty2 = [i for i,synsetsList in enumerate(synsetsLists2) if len(synsetsList) > 0]
+    if len(nonempty1) == 0 or len(nonempty2) == 0:
+        return sims
+    index1 = {name:i for i,name in enumerate(synsets1)}
+    index2 = {name:i for i,name in enumerate(synsets2)}
+    ids1 = [np.array([index1[synset.name()] for synset in synsetsLists1[i]],dtype=np.intp) for i in nonempty1]
+    ids2 = [np.array([index2[synset.name()] for synset in synsetsLists2[i]],dtype=np.intp) for i in nonempty2]
+    #The scores of the same lists are symmetric, unless NLTK simulates the root only for the first synset
+    symmetric = synsetsLists1 is synsetsLists2 and get_hypernyms().root_of_both
+    if symmetric:
+        scores = symmetric_synsets_similarity_matrix(list(synsets1.values()))
+    else:
+        scores = synsets_similarity_matrix(list(synsets1.values()),list(synsets2.values()))
+    #The score of each list of synsets onto each other list, and the same on the other direction
+    directed = aggregate_by_group(max_by_group(scores,ids2),ids1,stat)
+    if symmetric:
+        reverse = directed
+    else:
+        reverse = aggregate_by_group(max_by_group(scores.T,ids1),ids2,stat)
+    sims[np.ix_(nonempty1,nonempty2)] = (directed + reverse.T) / 2
+    return sims
+
+
+def synsets_similarity_matrix(synsets1: list, synsets2: list) -> np.ndarray:
+    """
+    Returns the similarity_matrix between some synsets, computing blocks of
+    rows on the pool of processes if it is enabled and there are at least
+    SIMILARITY_PROCESS_MIN_SYNSETS synsets on the rows.
+    """
+    if similarity_processes > 0 and len(synsets1) >= max(2,similarity_process_min_synsets):
+        names2 = [s.name() for s in synsets2]
+        with process_pool_in_use() as pool:
+            futures = [pool.submit(similarity_matrix_rows,[s.name() for s in rows],names2) for rows in shards(synsets1,similarity_processes)]
+            return np.concatenate([future.result() for future in futures])
+    return similarity_matrix(synsets1,synsets2)
+
+
+def symmetric_synsets_similarity_matrix(synsets: list, block=1024) -> np.ndarray:
+    """
+    Same as synsets_similarity_matrix between some synsets and themselves
+    when the scores are symmetric, but computing only the blocks of rows
+    from the diagonal and mirroring them.
+    """
+    scores = np.empty((len(synsets),len(synsets)))
+    for start in range(0,len(synsets),block):
+        rows = synsets_similarity_matrix(synsets[start:start+block],synsets[start:])
+        scores[start:start+block,start:] = rows
+        scores[start:,start:start+block] = rows.T
+    return scores
+
+
+def similarity_matrix_rows(names1: list, names2: list) -> np.ndarray:
+    """Same as similarity_matrix for synset names, so the rows can be computed on another process"""
+    return similarity_matrix([wn.synset(name) for name in names1],[wn.synset(name) for name in names2])
+
+
+def max_by_group(matrix: np.ndarray, groups: list, block=4096) -> np.ndarray:
+    """
+    Returns the matrix with the maximum of each row of matrix on the columns
+    of each group, where each group is a non empty array of column indices.
+    The groups are reduced on blocks of about block columns to bound the
+    memory used.
+    """
+    maxima = np.empty((matrix.shape[0],len(groups)))
+    start = 0
+    while start < len(groups):
+        end = start + 1
+        columns = len(groups[start])
+        while end < len(groups) and columns + len(groups[end]) <= block:
+            columns += len(groups[end])
+            end += 1
+        lengths = np.array([len(group) for group in groups[start:end]])
+        maxima[:,start:end] = np.maximum.reduceat(matrix[:,np.concatenate(groups[start:end])],np.cumsum(lengths)-lengths,axis=1)
+        start = end
+    return maxima
+
+
+def aggregate_by_group(maxima: np.ndarray, groups: list, stat="max") -> np.ndarray:
+    """Returns the matrix with the aggregate_scores of the rows of maxima of each group"""
+    return np.array([aggregate_scores(maxima[group],stat,axis=0) for group in groups]).reshape(len(groups),maxima.shape[1])
+
+
+def affinity_matrix(profiles: list, sims: np.ndarray) -> np.ndarray:
+    """
+    Returns the affinity between each pair of profiles, given as lists of
+    indices of attributes, and the similarity between each pair of
+    attributes. The affinity is the mean of the largest similarities of
+    the attributes of both profiles, as on sim_attrlst_attrlst.
+    """
+    affinities = np.zeros((len(profiles),len(profiles)))
+    nonempty = [i for i,profile in enumerate(profiles) if len(profile) > 0]
+    if len(nonempty) == 0:
+        return affinities
+    ids = [np.array(profiles[i],dtype=np.intp) for i in nonempty]
+    lengths = np.array([len(group) for group in ids])
+    totals = np.add.reduceat(max_by_group(sims,ids)[np.concatenate(ids)],np.cumsum(lengths)-lengths,axis=0)
+    affinities[np.ix_(nonempty,nonempty)] = (totals + totals.T) / (lengths.reshape(-1,1) + lengths.reshape(1,-1))
+    return affinities
+
 
 def detect_lang(source:str):
     """
@@ -561,10 +1197,32 @@ def detect_lang(source:str):
     str
         The detected language of the text
     """
-    #We take the ISO code of the languages
-    lang = modelFasttext.predict(source, k=10)[0] 
-    lang = next(l[-2:] for l in lang if l[-2:] in langs_iso_6291)
-    return lang
+    return detect_langs([source])[0]
+
+def detect_langs(texts:list) -> list:
+    """
+    Detect the language of some texts, remembering the languages of the
+    last texts. The texts that are not cached are sent to fastText at once.
+
+    Parameters
+    ----------
+    texts : list
+        The texts to detect their language
+    Returns
+    -------
+    list
+        The detected language of each text
+    """
+    langs = [languages_cache.get(text) for text in texts]
+    missing = list(dict.fromkeys(text for text,lang in zip(texts,langs) if lang is None))
+    if len(missing) == 0:
+        return langs
+    detected = {}
+    for text,labels in zip(missing,get_fasttext().predict(missing, k=10)[0]):
+        #We take the ISO code of the first supported language
+        detected[text] = next(l[-2:] for l in labels if l[-2:] in langs_iso_6291)
+        languages_cache.put(text,detected[text])
+    return [detected[text] if lang is None else lang for text,lang in zip(texts,langs)]
 
 if __name__ == '__main__':
     print("HELLO")
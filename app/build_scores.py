@@ -0,0 +1,214 @@
+#
+# Copyright 2019 - 2022 UDT-IA, IIIA-CSIC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import multiprocessing
+import os
+
+import numpy as np
+from nltk.corpus import wordnet as wn
+from WNS import ISO_6391_to_6392, get_hypernyms, getLemmatizer, normalize_attribute, path_score_matrix, resources, toks_to_synsets
+from scores import ScoreStore, merge, pair_keys
+
+# The synsets of the vocabulary on the process that scores the chunks
+vocabulary = []
+
+
+def extract_vocabulary(texts, lang="en") -> list:
+    """
+    Returns the sorted names of the synsets of the lemmas of some texts, the
+    same ones that are used when the texts are compared. The texts that
+    cannot be lemmatized are ignored.
+    """
+    lemmatizer = getLemmatizer(lang)
+    langISO6392 = ISO_6391_to_6392(lang)
+    lemmas = set()
+    for text in texts:
+        try:
+            lemmas.update(lemmatizer.lemmatize(text))
+        except Exception:
+            pass
+    return sorted(set(synset.name() for synset in toks_to_synsets(sorted(lemmas),lang=langISO6392)))
+
+
+def chunks(size: int, chunk_pairs: int, rows: int = None) -> list:
+    """
+    Splits the first rows (all of them by default) of the upper triangle
+    (with the diagonal) of a square matrix on consecutive ranges of rows
+    with about chunk_pairs pairs each.
+    """
+    if rows is None:
+        rows = size
+    ranges = []
+    start = 0
+    pairs = 0
+    for row in range(rows):
+        pairs += size - row
+        if pairs >= chunk_pairs:
+            ranges.append((start, row + 1))
+            start = row + 1
+            pairs = 0
+    if start < rows:
+        ranges.append((start, rows))
+    return ranges
+
+
+def init_process(names: list, hypernyms_path: str):
+    """Sets the vocabulary and loads WordNet and the index of hypernyms saved by the caller on a process of the pool"""
+    global vocabulary
+    vocabulary = [wn.synset(name) for name in names]
+    os.environ['HYPERNYMS_PATH'] = hypernyms_path
+    resources.preload("wordnet,hypernyms")
+
+
+def score_rows(start: int, end: int):
+    """
+    Returns the keys and the scores of the pairs formed by the synsets of the
+    rows [start,end) of the vocabulary with them and the following ones.
+    """
+    # Only the columns from the first row are scored, and the lower triangle of the block is discarded
+    scores = path_score_matrix(vocabulary[start:end], vocabulary[start:])
+    rows, columns = np.nonzero(np.arange(end - start).reshape(-1, 1) <= np.arange(len(vocabulary) - start).reshape(1, -1))
+    return pair_keys(rows + start, columns + start), scores[rows, columns].astype(np.float32)
+
+
+def chunk_path(checkpoint: str, start: int, end: int) -> str:
+    return os.path.join(checkpoint, "chunk-" + str(start) + "-" + str(end) + ".npz")
+
+
+def save_chunk(path: str, keys: np.ndarray, values: np.ndarray):
+    """Saves the scores of a chunk, replacing the file atomically"""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, keys=keys, values=values)
+    os.replace(tmp, path)
+
+
+def prepare_checkpoint(checkpoint: str, names: list):
+    """
+    Creates the checkpoint directory, or checks that the chunks already
+    on it were computed for the same vocabulary.
+    """
+    os.makedirs(checkpoint, exist_ok=True)
+    vocabulary_path = os.path.join(checkpoint, "vocabulary.txt")
+    if os.path.isfile(vocabulary_path):
+        with open(vocabulary_path, encoding="utf-8") as f:
+            if f.read().splitlines() != names:
+                raise ValueError("The checkpoint " + checkpoint + " was created for another vocabulary")
+    else:
+        with open(vocabulary_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(names))
+
+
+def remove_checkpoint(checkpoint: str):
+    """
+    Removes the files created on the checkpoint directory, and the directory
+    if nothing else is on it.
+    """
+    paths = glob.glob(os.path.join(checkpoint, "chunk-*.npz")) + [os.path.join(checkpoint, "vocabulary.txt"), os.path.join(checkpoint, "hypernyms.index")]
+    for path in paths:
+        if os.path.isfile(path):
+            os.remove(path)
+    if len(os.listdir(checkpoint)) == 0:
+        os.rmdir(checkpoint)
+
+
+def build_scores(names: list, path: str, checkpoint: str = None, processes: int = None, chunk_pairs: int = 100000, incremental: bool = False) -> ScoreStore:
+    """
+    Computes the scores between all the pairs of synsets of a vocabulary on
+    a pool of processes, and saves them as a score store on the path. On
+    incremental mode the scores already on the path are kept, and only the
+    pairs with a synset that is not on it are computed and merged with them.
+
+    Each pair is computed only once, and the pairs are divided on chunks of
+    rows that are saved on the checkpoint directory as they are finished,
+    so a build that is interrupted continues from the last chunks done. The
+    checkpoint files are removed when the store is saved.
+    """
+    names = sorted(set(names))
+    base = None
+    if incremental and os.path.isfile(path):
+        base = ScoreStore.load(path)
+        # The new synsets are the first rows, paired with them and all the known ones
+        names = [name for name in names if base.id(name) < 0]
+        rows = len(names)
+        names = names + base.names
+    else:
+        rows = len(names)
+    if checkpoint is None:
+        checkpoint = path + ".chunks"
+    prepare_checkpoint(checkpoint, names)
+    ranges = chunks(len(names), chunk_pairs, rows)
+    pending = [(start, end) for start, end in ranges if not os.path.isfile(chunk_path(checkpoint, start, end))]
+    print(str(len(ranges) - len(pending)) + " of " + str(len(ranges)) + " chunks already computed")
+    if len(pending) > 0:
+        hypernyms_path = os.path.join(checkpoint, "hypernyms.index")
+        get_hypernyms().save(hypernyms_path)
+        # The processes are spawned so they do not inherit the state of the caller
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=init_process, initargs=(names, hypernyms_path)) as pool:
+            futures = {pool.submit(score_rows, start, end): (start, end) for start, end in pending}
+            for done, future in enumerate(as_completed(futures), 1):
+                keys, values = future.result()
+                save_chunk(chunk_path(checkpoint, *futures[future]), keys, values)
+                print("Chunk " + str(done) + " of " + str(len(pending)) + " computed")
+
+    keys = []
+    values = []
+    for start, end in ranges:
+        with np.load(chunk_path(checkpoint, start, end)) as chunk:
+            keys.append(chunk["keys"])
+            values.append(chunk["values"])
+    keys = np.concatenate(keys) if len(keys) > 0 else np.empty(0, dtype=np.int64)
+    values = np.concatenate(values) if len(values) > 0 else np.empty(0, dtype=np.float32)
+    order = np.argsort(keys, kind="stable")
+    store = ScoreStore(names, keys[order], values[order])
+    if base is not None:
+        store = merge([base, store])
+    store.save(path)
+    remove_checkpoint(checkpoint)
+    return store
+
+
+def read_texts(paths: list, attributes: bool = False) -> list:
+    """Reads the non empty lines of some files, normalizing them if they are attribute names"""
+    texts = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            texts.extend(line.strip() for line in f if line.strip() != "")
+    if attributes:
+        texts = [normalize_attribute(text) for text in texts]
+    return texts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precompute the similarity scores between the synsets of the lemmas of some texts.")
+    parser.add_argument("inputs", nargs="+", help="The files with a text per line.")
+    parser.add_argument("--attributes", action="store_true", help="The lines of the files are attribute names, as the ones of /calculateSimilarityOf.")
+    parser.add_argument("--lang", default="en", help="The language of the texts in ISO 639-1 format.")
+    parser.add_argument("--output", default=os.getenv('SCORES_PATH', "./scores.store"), help="The score store file to write.")
+    parser.add_argument("--checkpoint", default=None, help="The directory where the computed chunks are saved, by default the output with the suffix .chunks.")
+    parser.add_argument("--processes", type=int, default=None, help="The number of processes, by default the number of CPUs.")
+    parser.add_argument("--chunk-pairs", type=int, default=100000, help="The number of pairs of synsets on each chunk.")
+    parser.add_argument("--incremental", action="store_true", help="Keep the scores already on the output and compute only the ones of the new synsets.")
+    args = parser.parse_args()
+
+    names = extract_vocabulary(read_texts(args.inputs, args.attributes), args.lang)
+    print(str(len(names)) + " synsets on the vocabulary")
+    store = build_scores(names, args.output, args.checkpoint, args.processes, args.chunk_pairs, args.incremental)
+    print(str(len(store)) + " scores of " + str(len(store.names)) + " synsets written to " + args.output)
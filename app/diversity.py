@@ -15,25 +15,73 @@
 #
 
 import copy
+import itertools
+from math import comb
 import operator
+import random
+import threading
+import time
+import weakref
 
 import numpy as np
 
 QN = 0
 QL = 1
 
+# Maximum number of quantitative attributes used to place the agents on the
+# grid of buildEquivalenceIndex, the neighbour cells to check grow as 3^n.
+GRID_DIMENSIONS = 3
+
+# Maximum number of possible teams that findDiverseTeams scores exhaustively.
+EXHAUSTIVE_LIMIT = 20000
+
+
+# The schemas in use, by the identifiers of their attributes.
+schemas = weakref.WeakValueDictionary()
+schemasLock = threading.Lock()
+
+
+class AttributeSchema(object):
+	"""The identifiers of the attributes of some agents, in the same order
+	on all of them, and the position of each identifier on the list, where
+	the first one wins as on the list.
+	"""
+
+	__slots__ = ('ids', 'positions', '__weakref__')
+
+	def __init__(self, ids):
+		self.ids = tuple(ids)
+		self.positions = {}
+		for i, attr_id in enumerate(self.ids):
+			self.positions.setdefault(attr_id, i)
+
+	@classmethod
+	def of(cls, attributes):
+		"""Returns the schema of a list of attributes, shared by all the lists with the same identifiers"""
+		ids = tuple(attr.id for attr in attributes)
+		with schemasLock:
+			schema = schemas.get(ids)
+			if schema is None:
+				schema = cls(ids)
+				schemas[ids] = schema
+		return schema
+
 
 class Agent(object):
 	"""docstring for ClassName"""
 
-	def __init__(self, id, attributes):
+	__slots__ = ('id', 'attributes', 'equivalent', 'schema')
+
+	def __init__(self, id, attributes, schema=None):
 		self.id = id
 		self.attributes = attributes
 		self.equivalent = {attr: [] for attr in attributes}
+		# The schema can be given when it is shared by many agents, or it is the one of their identifiers
+		self.schema = schema if schema is not None else AttributeSchema.of(attributes)
 
 	def getValue(self, attr):
-		for i in self.attributes:
-			if i == attr:return i.value
+		if isinstance(attr, Attribute) and attr.id in self.schema.positions:
+			return self.attributes[self.schema.positions[attr.id]].value
 		return None
 
 	def __str__(self):
@@ -64,6 +112,8 @@ class Agent(object):
 class Attribute(object):
 	"""docstring for ClassName"""
 
+	__slots__ = ('id', 'type', 'range', 'value')
+
 	def __init__(self, attribute_id, attribute_type, attribute_range, value=None):
 		self.id = attribute_id
 		self.type = attribute_type
@@ -95,20 +145,110 @@ class Attribute(object):
 		return hash(self.id)
 
 
+class TeamMatrix(object):
+	"""Columnar representation of the attribute values of a team.
+
+	The quantitative attributes are stored as a float matrix and the
+	qualitative ones as integer codes of the options on their range, both
+	with one row per attribute and one column per agent.
+	"""
+
+	def __init__(self, attribute_ids, columns):
+		self.attributes = list(attribute_ids)
+		self.quantitative_ids = [attr for attr in self.attributes if attr.type != QL]
+		self.qualitative_ids = [attr for attr in self.attributes if attr.type == QL]
+		size = len(columns[0]) if len(columns) > 0 else 0
+		self.quantitative = np.empty((len(self.quantitative_ids), size))
+		self.qualitative = np.empty((len(self.qualitative_ids), size), dtype=np.intp)
+		self.sizes = np.array([len(attr.range) for attr in self.qualitative_ids], dtype=np.intp)
+		qn = 0
+		ql = 0
+		for attr, column in zip(self.attributes, columns):
+			if None in column:
+				raise ValueError("Undefined value for the attribute " + str(attr))
+			if attr.type == QL:
+				codes = {option: i for i, option in enumerate(attr.range)}
+				self.qualitative[ql] = [codes[val] for val in column]
+				ql += 1
+			else:
+				self.quantitative[qn] = column
+				qn += 1
+
+	@classmethod
+	def fromAgents(cls, team, attribute_ids):
+		return cls(attribute_ids, [[a.getValue(attr) for a in team] for attr in attribute_ids])
+
+	def __len__(self):
+		return self.quantitative.shape[1]
+
+	def attributeDiversity(self):
+		"""Return the diversity of each attribute, on the order of the attributes"""
+		values = np.empty(len(self.attributes))
+		is_ql = np.array([attr.type == QL for attr in self.attributes], dtype=bool)
+		values[~is_ql] = np.std(self.quantitative, axis=1)
+		if len(self.qualitative_ids) > 0:
+			values[is_ql] = entropy(self.qualitative, self.sizes)
+		return values
+
+	def diversity(self):
+		sd = 0
+		for value in self.attributeDiversity():
+			sd += value
+		return sd
+
+	def batchDiversity(self, teams):
+		"""
+		Return the diversity of several teams formed by the agents of the
+		matrix, where each team is given as the list of its column indices.
+		"""
+		sizes = np.array([len(team) for team in teams], dtype=np.intp)
+		if np.any(sizes == 0):
+			raise ValueError("Can not calculate the diversity of an empty team")
+		members = np.concatenate([np.asarray(team, dtype=np.intp) for team in teams] + [np.empty(0, dtype=np.intp)])
+		starts = _offsets(sizes)
+		values = np.empty((len(teams), len(self.attributes)))
+		is_ql = np.array([attr.type == QL for attr in self.attributes], dtype=bool)
+		if len(teams) > 0 and len(self.quantitative_ids) > 0:
+			columns = self.quantitative[:, members]
+			means = np.add.reduceat(columns, starts, axis=1) / sizes
+			deviations = columns - np.repeat(means, sizes, axis=1)
+			values[:, ~is_ql] = np.sqrt(np.add.reduceat(deviations * deviations, starts, axis=1) / sizes).T
+		if len(teams) > 0 and len(self.qualitative_ids) > 0:
+			total = int(np.sum(self.sizes))
+			offsets = _offsets(self.sizes)
+			bins = self.qualitative[:, members] + offsets[:, None] + np.repeat(np.arange(len(teams)) * total, sizes)
+			freq = np.bincount(bins.ravel(), minlength=len(teams) * total).reshape(len(teams), total)
+			values[:, is_ql] = _normalizedEntropy(freq / sizes[:, None], self.sizes)
+		sd = np.zeros(len(teams))
+		for column in values.T:
+			sd += column
+		return sd
+
+
+def _offsets(sizes):
+	return np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.intp)
+
+
+def _normalizedEntropy(prop, sizes):
+	"""
+	Normalized entropy of the proportions of the options on the last axis of
+	prop, where the options of consecutive attributes have the given sizes.
+	"""
+	logs = np.log(prop, out=np.zeros(prop.shape), where=prop > 0)
+	return np.add.reduceat(-(prop * logs) / np.repeat(np.log(sizes), sizes), _offsets(sizes), axis=-1)
+
+
+def entropy(codes, sizes):
+	"""
+	Normalized entropy of each row of codes, where the codes of the row i
+	are on the range [0, sizes[i]).
+	"""
+	freq = np.bincount((codes + _offsets(sizes)[:, None]).ravel(), minlength=int(np.sum(sizes)))
+	return _normalizedEntropy(freq / codes.shape[1], sizes)
+
+
 def diversity(team, attribute_ids):
-	sd = 0
-	for attr in attribute_ids:
-		if attr.type == QL:
-			freq = { option:0 for option in attr.range }
-			for a in team:
-				val = a.getValue(attr)
-				freq[val] += 1
-			prop = {option:freq[option] / len(team) for option in freq}
-			diversity = sum([ -(prop[option] * np.log(prop[option])) / np.log(len(attr.range)) for option in prop if prop[option] > 0])
-		else:
-			diversity = np.std([a.getValue(attr) for a in team])
-		sd += diversity
-	return sd
+	return TeamMatrix.fromAgents(team, attribute_ids).diversity()
 
 
 def findEquivalentAgents(agent, attribute, agents, reqattr=None, epsilon=1e-2):
@@ -129,23 +269,198 @@ def findEquivalentAgents(agent, attribute, agents, reqattr=None, epsilon=1e-2):
 	return eq
 
 
+class TeamDiversityState(object):
+	"""
+	Running statistics of the attributes of a team, which allow to obtain the
+	change of the diversity when a member is swapped without recalculating it.
+
+	The quantitative attributes keep the sum and the sum of squares of their
+	values and the qualitative ones the number of agents with each option.
+	"""
+
+	def __init__(self, team, attribute_ids):
+		self.attributes = list(attribute_ids)
+		self.size = len(team)
+		self.members = set(team)
+		self.sums = {}
+		self.squares = {}
+		self.counts = {}
+		self.values = {}
+		for attr in self.attributes:
+			if attr.type == QL:
+				counts = {option: 0 for option in attr.range}
+				for a in team:
+					counts[a.getValue(attr)] += 1
+				self.counts[attr] = counts
+				self.values[attr] = sum([self._term(attr, counts[option]) for option in counts])
+			else:
+				values = [a.getValue(attr) for a in team]
+				self.sums[attr] = sum(values)
+				self.squares[attr] = sum([val * val for val in values])
+				self.values[attr] = self._std(self.sums[attr], self.squares[attr])
+
+	def __contains__(self, agent):
+		return agent in self.members
+
+	def _term(self, attr, count):
+		if count <= 0:
+			return 0
+		prop = count / self.size
+		return -(prop * np.log(prop)) / np.log(len(attr.range))
+
+	def _std(self, total, squares):
+		mean = total / self.size
+		return np.sqrt(max(squares / self.size - mean * mean, 0.0))
+
+	def _swapped(self, attr, old, new):
+		"""Return the change of the diversity of an attribute if the value old is replaced by new"""
+		if attr.type == QL:
+			counts = self.counts[attr]
+			delta = (self._term(attr, counts[old] - 1) - self._term(attr, counts[old])) + (self._term(attr, counts[new] + 1) - self._term(attr, counts[new]))
+			return delta, None, None
+		total = self.sums[attr] - old + new
+		squares = self.squares[attr] - old * old + new * new
+		return self._std(total, squares) - self.values[attr], total, squares
+
+	def diversity(self):
+		sd = 0
+		for attr in self.attributes:
+			sd += self.values[attr]
+		return sd
+
+	def swapDelta(self, agent, other):
+		"""Return the change of the diversity if agent is replaced by other"""
+		delta = 0
+		for attr in self.attributes:
+			old = agent.getValue(attr)
+			new = other.getValue(attr)
+			if old != new:
+				delta += self._swapped(attr, old, new)[0]
+		return delta
+
+	def swap(self, agent, other):
+		"""Replace the member agent by other"""
+		for attr in self.attributes:
+			old = agent.getValue(attr)
+			new = other.getValue(attr)
+			if old != new:
+				delta, total, squares = self._swapped(attr, old, new)
+				self.values[attr] += delta
+				if attr.type == QL:
+					self.counts[attr][old] -= 1
+					self.counts[attr][new] += 1
+				else:
+					self.sums[attr] = total
+					self.squares[attr] = squares
+		self.members.discard(agent)
+		self.members.add(other)
+
+
+def buildEquivalenceIndex(agents, reqattr, epsilon=1e-2):
+	"""
+	Fill the equivalent agents of every agent for each attribute of reqattr,
+	as findEquivalentAgents does, but without comparing all the pairs.
+
+	For each attribute the agents are bucketed by the values of the other
+	qualitative attributes and placed on a grid of cells of size epsilon over
+	the other quantitative attributes, so each agent is only compared with
+	the agents of its bucket that are on the same or a neighbour cell.
+	"""
+	values = {attr: [a.getValue(attr) for a in agents] for attr in reqattr}
+	size = epsilon * (1 + 1e-9) # Slightly bigger cells never lose a neighbour by rounding
+	for attribute in reqattr:
+		others = [attr for attr in reqattr if attr != attribute]
+		qualitative = [values[attr] for attr in others if attr.type == QL]
+		quantitative = [values[attr] for attr in others if attr.type != QL]
+		grid = quantitative[:GRID_DIMENSIONS] if epsilon > 0 else []
+		cells = np.zeros((len(agents), len(grid)), dtype=int)
+		if len(grid) > 0:
+			cells = np.floor(np.array(grid, dtype=float).T / size).astype(int)
+		buckets = {}
+		keys = []
+		for i in range(len(agents)):
+			key = (tuple(column[i] for column in qualitative), tuple(cells[i]))
+			buckets.setdefault(key, []).append(i)
+			keys.append(key)
+
+		offsets = list(itertools.product((-1, 0, 1), repeat=len(grid)))
+		for i, agent in enumerate(agents):
+			label, cell = keys[i]
+			candidates = []
+			for offset in offsets:
+				candidates.extend(buckets.get((label, tuple(c + o for c, o in zip(cell, offset))), []))
+			candidates.sort()
+			eq = []
+			for j in candidates:
+				if agents[j] != agent and not any(abs(column[j] - column[i]) > epsilon for column in quantitative):
+					eq.append(agents[j])
+			agent.equivalent[attribute] = eq
+
+
 def changeDiversity (team, attribute, epsilon=0.1, positive=True):
 
-	current_diversity = diversity(team, [attribute])
+	state = TeamDiversityState(team, [attribute])
 	alternative_teams = []
+	found = set()
 	for agent in team:
 		for a in agent.equivalent[attribute]:
-			if a not in team:
-				new_team = sorted([i for i in team if i != agent] + [a])
-				new_diversity = diversity(new_team, [attribute])
-				diff = current_diversity - new_diversity
-
-				# print(tuple(new_team),diff)
-				if ((diff >= epsilon and positive) or (diff <= epsilon and ~positive)) and (new_team not in alternative_teams):
-					alternative_teams += [new_team]
+			if a not in state:
+				diff = -state.swapDelta(agent, a)
+				if (diff >= epsilon and positive) or (diff <= epsilon and ~positive):
+					new_team = sorted([i for i in team if i != agent] + [a])
+					if tuple(new_team) not in found:
+						found.add(tuple(new_team))
+						alternative_teams += [new_team]
 	return alternative_teams
 
 
+def findDiverseTeams(agents, attribute_ids, size, count=1, budget=1.0, seed=None):
+	"""
+	Search the count most diverse teams of the given size formed by the agents.
+
+	When the number of possible teams is small all of them are scored,
+	otherwise a local search swaps the members of random teams while the
+	diversity grows, restarting from a new random team at each local optimum
+	until budget seconds have passed.
+
+	Returns a list of pairs (team, diversity) from the most diverse team,
+	where each team is sorted as on changeDiversity.
+	"""
+	if size <= 0 or size > len(agents) or count <= 0:
+		return []
+
+	if comb(len(agents), size) <= EXHAUSTIVE_LIMIT:
+		teams = list(itertools.combinations(range(len(agents)), size))
+		values = TeamMatrix.fromAgents(agents, attribute_ids).batchDiversity(teams)
+		best = np.argsort(-values, kind='stable')[:count]
+		return [(sorted([agents[i] for i in teams[t]]), values[t]) for t in best]
+
+	deadline = time.monotonic() + budget
+	rng = random.Random(seed)
+	found = {}
+	while len(found) == 0 or time.monotonic() < deadline:
+		team = rng.sample(agents, size)
+		state = TeamDiversityState(team, attribute_ids)
+		found[frozenset(team)] = state.diversity()
+		improved = True
+		while improved and time.monotonic() < deadline:
+			improved = False
+			for position in range(size):
+				member = team[position]
+				delta, best = max(((state.swapDelta(member, a), a) for a in agents if a not in state), key=operator.itemgetter(0))
+				if delta > 1e-12:
+					state.swap(member, best)
+					team[position] = best
+					found[frozenset(team)] = state.diversity()
+					improved = True
+
+		if len(found) > 4 * count:
+			found = dict(sorted(found.items(), key=operator.itemgetter(1), reverse=True)[:count])
+
+	teams = [sorted(team) for team, _ in sorted(found.items(), key=operator.itemgetter(1), reverse=True)[:count]]
+	return [(team, diversity(team, attribute_ids)) for team in teams]
+
+
 if __name__ == '__main__':
 
 	agents = []
@@ -154,6 +469,7 @@ if __name__ == '__main__':
 
 	attribute_types = {QN:[0, 1], QL:options}
 	print('Generating data...')
+	schema = AttributeSchema(attribute_ids)
 	for i in range(2000):
 		attributes = []
 		for attr in attribute_ids:
@@ -163,7 +479,7 @@ if __name__ == '__main__':
 					attr, attribute_ids[attr], attribute_types[attribute_ids[attr] ], val[0]
 					)
 				)
-		agents.append(Agent(i, attributes))
+		agents.append(Agent(i, attributes, schema))
 
 	print('Diversity')
 	reqattr = [Attribute(1000, QN, [0, 1]), Attribute(1002, QL, options)]
@@ -173,9 +489,7 @@ if __name__ == '__main__':
 	print('-' * 50)
 
 	print('Finding Equivalences...')
-	for agent in agents:
-		for attr in reqattr:
-			agent.equivalent[attr] = findEquivalentAgents(agents[0], attr, agents, reqattr=reqattr)
+	buildEquivalenceIndex(agents, reqattr)
 
 	attr = reqattr[0]
 	alternative_teams = changeDiversity(team, attr, epsilon=0.1, positive=False)
@@ -0,0 +1,239 @@
+#
+# Copyright 2019 - 2022 UDT-IA, IIIA-CSIC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import argparse
+import os
+import threading
+
+import numpy as np
+
+# Distance of the synsets that are not ancestors of a synset
+UNREACHABLE = 1 << 20
+
+
+def simulates_root_of_both(wordnet) -> bool:
+    """
+    Checks if the path similarity of the installed NLTK simulates the root of
+    the taxonomies when any of the synsets needs it, or only when the first
+    one needs it as the versions before 3.6 do.
+    """
+    return wordnet.synset("entity.n.01").path_similarity(wordnet.synset("be.v.01")) is not None
+
+
+class HypernymIndex:
+    """
+    The ancestors (hypernyms and instance hypernyms) of each synset with the
+    length of the shortest path to them, to compute the path similarity as
+    NLTK does but without traversing the synsets.
+
+    The synsets are identified by their position on names, and the ancestors
+    of the synset i are the ones from offsets[i] to offsets[i+1] on the arrays
+    ancestors and distances, including itself at distance 0.
+    """
+
+    def __init__(self, names, offsets, ancestors, distances, needs_root, root_of_both=True):
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.offsets = offsets
+        self.ancestors = ancestors
+        self.distances = distances
+        self.needs_root = needs_root
+        self.root_of_both = root_of_both
+        # The distance to the simulated root is the distance to the furthest ancestor plus one
+        self.root_distances = np.maximum.reduceat(distances, offsets[:-1]).astype(np.int32) + 1 if len(self.names) > 0 else np.empty(0, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def ids(self, names) -> np.ndarray:
+        """Returns the identifiers of some synset names, -1 for the unknown ones"""
+        return np.array([self.index.get(name, -1) for name in names], dtype=np.int64)
+
+    @classmethod
+    def fromWordNet(cls, wordnet, root_of_both=None):
+        """Builds the index of all the synsets of a WordNet corpus reader"""
+        if root_of_both is None:
+            root_of_both = simulates_root_of_both(wordnet)
+        synsets = list(wordnet.all_synsets())
+        index = {synset.name(): i for i, synset in enumerate(synsets)}
+        paths = [None] * len(synsets)
+
+        def shortest_paths(i):
+            if paths[i] is None:
+                path = {i: 0}
+                for hypernym in synsets[i]._hypernyms() + synsets[i]._instance_hypernyms():
+                    for ancestor, distance in shortest_paths(index[hypernym.name()]).items():
+                        if distance + 1 < path.get(ancestor, UNREACHABLE):
+                            path[ancestor] = distance + 1
+                paths[i] = path
+            return paths[i]
+
+        offsets = np.zeros(len(synsets) + 1, dtype=np.int64)
+        ancestors = []
+        distances = []
+        for i in range(len(synsets)):
+            path = shortest_paths(i)
+            ancestors.extend(sorted(path))
+            distances.extend(path[ancestor] for ancestor in sorted(path))
+            offsets[i + 1] = len(ancestors)
+        # As Synset._needs_root, but reading the version of WordNet only once
+        nouns_need_root = wordnet.get_version() == "1.6"
+        needs_root = np.array([synset.pos() != "n" or nouns_need_root for synset in synsets], dtype=bool)
+        return cls([synset.name() for synset in synsets], offsets, np.array(ancestors, dtype=np.int32), np.array(distances, dtype=np.int16), needs_root, root_of_both)
+
+    @classmethod
+    def load(cls, path: str, root_of_both=True):
+        """Loads an index saved with save"""
+        with np.load(path, allow_pickle=False) as data:
+            names = [name.decode("utf-8") for name in data["names"]]
+            return cls(names, data["offsets"], data["ancestors"], data["distances"], data["needs_root"], root_of_both)
+
+    def save(self, path: str):
+        """Saves the index on a file, replacing it atomically"""
+        names = np.array([name.encode("utf-8") for name in self.names], dtype=bytes)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, names=names, offsets=self.offsets, ancestors=self.ancestors, distances=self.distances, needs_root=self.needs_root)
+        os.replace(tmp, path)
+
+    def distance_matrix(self, ids1, ids2) -> np.ndarray:
+        """
+        Returns the matrix with the length of the shortest path between each
+        synset of ids1 (rows) and each synset of ids2 (columns), as
+        Synset.shortest_path_distance with the root simulated as on
+        Synset.path_similarity, where the synsets without path or unknown
+        are -1.
+        """
+        ids1 = np.asarray(ids1, dtype=np.int64)
+        ids2 = np.asarray(ids2, dtype=np.int64)
+        matrix = np.full((len(ids1), len(ids2)), -1, dtype=np.int64)
+        columns = np.flatnonzero(ids2 >= 0)
+        if len(columns) == 0:
+            return matrix
+        ids = ids2[columns]
+        starts = self.offsets[ids]
+        lengths = self.offsets[ids + 1] - starts
+        segments = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - segments, lengths) + np.arange(lengths.sum())
+        ancestors = self.ancestors[positions]
+        distances = self.distances[positions].astype(np.int32)
+        root_distances = self.root_distances[ids]
+        for row, id1 in enumerate(ids1):
+            if id1 < 0:
+                continue
+            start, end = self.offsets[id1], self.offsets[id1 + 1]
+            # The ancestors of each synset are sorted, so the common ones are searched
+            row_ancestors = self.ancestors[start:end]
+            found = np.minimum(np.searchsorted(row_ancestors, ancestors), len(row_ancestors) - 1)
+            common = np.where(row_ancestors[found] == ancestors, self.distances[start:end][found] + distances, UNREACHABLE)
+            # The shortest path through a common ancestor of each column
+            distance = np.minimum.reduceat(common, segments)
+            if self.root_of_both:
+                root = self.needs_root[id1] | self.needs_root[ids]
+            else:
+                root = np.full(len(ids), self.needs_root[id1])
+            distance = np.where(root, np.minimum(distance, self.root_distances[id1] + root_distances), distance)
+            distance[ids == id1] = 0
+            matrix[row, columns] = np.where(distance >= UNREACHABLE, -1, distance)
+        return matrix
+
+    def path_similarity(self, name1: str, name2: str):
+        """
+        Returns the path similarity between two synset names as
+        Synset.path_similarity, or None if there is no path between them or
+        any of them is unknown.
+        """
+        distance = self.distance_matrix(self.ids([name1]), self.ids([name2]))[0, 0]
+        if distance < 0:
+            return None
+        return 1.0 / (distance + 1)
+
+
+class AncestorIndex:
+    """
+    Inverted index from the ancestors of the synsets of some items (as the
+    attributes) to the items, to find the items with a synset at a path
+    distance of at most depth from some synsets without comparing them.
+
+    Each synset of an item is indexed by its ancestors up to depth, and by
+    its distance to the simulated root. The items with a synset that is not
+    on the hypernym index are always candidates.
+    """
+
+    def __init__(self, hypernyms: HypernymIndex, depth: int = 2):
+        self.hypernyms = hypernyms
+        self.depth = depth
+        self.postings = {}
+        self.root_postings = {}
+        self.items = set()
+        self.unknown = set()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def _ancestors(self, i: int) -> np.ndarray:
+        start, end = self.hypernyms.offsets[i], self.hypernyms.offsets[i + 1]
+        return self.hypernyms.ancestors[start:end][self.hypernyms.distances[start:end] <= self.depth]
+
+    def add(self, item, names):
+        """Indexes an item by the names of its synsets"""
+        ids = self.hypernyms.ids(names)
+        with self.lock:
+            self.items.add(item)
+            if (ids < 0).any():
+                self.unknown.add(item)
+                return
+            for i in ids:
+                for ancestor in self._ancestors(i):
+                    self.postings.setdefault(int(ancestor), set()).add(item)
+                self.root_postings.setdefault(int(self.hypernyms.root_distances[i]), set()).add(item)
+
+    def candidates(self, names):
+        """
+        Returns the indexed items with a synset at a distance of at most depth
+        from any of the given synsets, or None if any of them is unknown.
+        """
+        ids = self.hypernyms.ids(names)
+        if (ids < 0).any():
+            return None
+        with self.lock:
+            candidates = set(self.unknown)
+            for i in ids:
+                for ancestor in self._ancestors(i):
+                    candidates.update(self.postings.get(int(ancestor), ()))
+                # The path through the simulated root is as long as the distances of both synsets to it
+                for root_distance, items in self.root_postings.items():
+                    if self.hypernyms.root_distances[i] + root_distance <= self.depth:
+                        candidates.update(items)
+        return candidates
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the index of the hypernyms of the WordNet synsets.")
+    parser.add_argument("output", help="The index file to write.")
+    args = parser.parse_args()
+
+    from nltk.corpus import wordnet as wn
+    index = HypernymIndex.fromWordNet(wn)
+    index.save(args.output)
+    print(str(len(index.ancestors)) + " ancestors of " + str(len(index)) + " synsets written to " + args.output)
@@ -14,19 +14,22 @@
 # limitations under the License.
 #
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 import json
-from math import comb
 import os
-import re
 import time
 
-from WNS import sim_str_str, detect_lang
-from diversity import Attribute, Agent, QN, QL, diversity
+from WNS import cache_stats, detect_lang, get_scores, normalize_attribute, reload_scores, resources, sim_attrlst_matrix, sim_str_iter, sim_str_many, sim_str_top, warm_attribute_synsets, watch_scores
+from diversity import Agent, Attribute, AttributeSchema, QN, QL, TeamMatrix, findDiverseTeams
 from fastapi import FastAPI, Body, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field, HttpUrl
 from typing import List, Dict
 
+# Load the resources of PRELOAD_RESOURCES when the server starts, before forking the workers on gunicorn --preload
+resources.preload(os.getenv('PRELOAD_RESOURCES',""))
 
 # Setup Web services
 app  = FastAPI(
@@ -43,6 +46,31 @@ class Info(BaseModel):
     vendor: str = Field(...,description="Contain information of the organization that has implemented the API.",example="UDT-IA, IIIA-CSIC")
     license: str = Field(...,description="Contain information of the license of the API.",example="Apache v2")
     
+# The state of a cache
+class CacheMetrics(BaseModel):
+    size: int = Field(...,ge=0,description="The number of cached entries.")
+    maxSize: int = Field(...,description="The maximum number of cached entries.")
+    hits: int = Field(...,ge=0,description="The number of times an entry was found on the cache.")
+    misses: int = Field(...,ge=0,description="The number of times an entry was not found on the cache.")
+    evictions: int = Field(...,ge=0,description="The number of entries removed because the cache was full.")
+    hitRate: float = Field(...,ge=0.0,le=1.0,description="The fraction of the searches that found the entry on the cache.")
+
+# The state of a resource
+class ResourceMetrics(BaseModel):
+    instances: int = Field(...,ge=0,description="The number of instances loaded of the resource.")
+    loadTime: float = Field(None,description="The seconds spent loading the last instance of the resource.")
+
+# Metrics of the worker that responds
+class Metrics(BaseModel):
+    caches: Dict[str,CacheMetrics] = Field({},description="The state of the caches, where the key is the name of the cache.")
+    resources: Dict[str,ResourceMetrics] = Field({},description="The state of the resources, where the key is the name of the resource.")
+
+# The state of the precomputed similarity scores
+class ScoresInfo(BaseModel):
+    reloaded: bool = Field(...,description="If the scores have been loaded again.")
+    scores: int = Field(...,ge=0,description="The number of pairs of synsets with a precomputed score.")
+    synsets: int = Field(...,ge=0,description="The number of synsets with a precomputed score.")
+
 # Information of an agent to obtain the diversity
 class AgentData(BaseModel):
     id: str = Field(...,description="Contain the identifier of the agent.",example="1")
@@ -59,6 +87,29 @@ class AgentsData(BaseModel):
 class Diversity(BaseModel):
     value: float = Field(...,ge=0.0,le=1.0,description="The diversity of a set of users.")
 
+# Set of teams formed from a pool of agents to calculate their diversity
+class TeamsData(AgentsData):
+    teams: List[List[str]] = Field([],description="The teams to calculate its diversity, where each team is the list of the identifiers of its agents.",example="[[\"1\",\"2\"],[\"1\",\"3\"]]")
+
+# The diversity of some teams
+class Diversities(BaseModel):
+    values: List[float] = Field([],description="The diversity of each team, on the same order of the teams.")
+
+# Set of agents to search the most diverse teams
+class DiverseTeamsData(AgentsData):
+    teamSize: int = Field(...,ge=1,description="The number of agents on each team.",example=3)
+    maxTeams: int = Field(1,ge=1,le=100,description="The maximum number of teams to return.",example=5)
+    timeBudget: float = Field(1.0,gt=0.0,le=60.0,description="The maximum number of seconds to spend searching the teams.",example=1.0)
+
+# A team and its diversity
+class DiverseTeam(BaseModel):
+    agents: List[str] = Field([],description="The identifiers of the agents of the team.",example="[\"1\",\"2\",\"3\"]")
+    diversity: float = Field(...,ge=0.0,le=1.0,description="The diversity of the team.")
+
+# The most diverse teams
+class DiverseTeams(BaseModel):
+    teams: List[DiverseTeam] = Field([],description="The most diverse teams found, from the most diverse.")
+
 # The type of statistic function
 class Aggregation(str, Enum):
     max = "max"
@@ -72,6 +123,11 @@ class AttributesData(BaseModel):
     attributes: List[str] = Field([],description="Attributes to filter",example="[\"attribute1\",\"attribute2\"]")
     aggregation: Aggregation = Field("max",description="The aggregation value to use")
 
+# The data to obtain the attributes most similar to a text
+class RankedAttributesData(AttributesData):
+    topK: int = Field(None,ge=1,description="The maximum number of attributes to return, the most similar ones. If it is defined or minSimilarity is greater than 0 the attributes are returned from the most similar.",example=5)
+    minSimilarity: float = Field(0.0,ge=0.0,le=1.0,description="The minimum similarity of the attributes to return.",example=0.5)
+
 # The similarity of an attribute
 class AttributeSimilarity(BaseModel):
     attribute: str = Field(...,description="The name of the attribute.",example="\"attribute1\"")
@@ -81,6 +137,29 @@ class AttributeSimilarity(BaseModel):
 class Similarities(BaseModel):
     similarities: List[AttributeSimilarity] = Field([],description="The similarities of the text with the attributes.")
     
+# The attributes of a profile to compare
+class ProfileData(BaseModel):
+    id: str = Field(...,description="Contain the identifier of the profile.",example="1")
+    attributes: Dict[str,str] = Field({},description="The attributes of the profile, where the key is the name of the attribute and the value is a string with the attribute value.",example="{\"occupation\":\"app developer\",\"hobby\":\"climbing\"}")
+
+# Set of profiles to calculate their affinity
+class ProfilesData(BaseModel):
+    profiles: List[ProfileData] = Field([],description="The profiles to compare.")
+    aggregation: Aggregation = Field("max",description="The aggregation value to use")
+
+# The affinity between each pair of profiles
+class ProfilesAffinity(BaseModel):
+    profiles: List[str] = Field([],description="The identifiers of the profiles, on the order of the rows and the columns of the affinities.")
+    affinities: List[List[float]] = Field([],description="The symmetric matrix with the affinity, on the range [0,1], between each pair of profiles.")
+
+# The pool of threads where the blocking computations are done, so they do not block the event loop
+executor = ThreadPoolExecutor(max_workers=int(os.getenv('MAX_EXECUTOR_WORKERS',"4")))
+
+async def run_in_executor(function,*args):
+    """Run a function on the pool of threads and wait for its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor,function,*args)
+
 @app.get(
     "/help/info",
     description="Obtain information of the extension",
@@ -97,6 +176,39 @@ async def get_help_info():
         "license": "Apache v2"
     } 
 
+@app.get(
+    "/help/metrics",
+    description="Obtain the state of the caches and the resources of the worker that responds",
+    status_code=200,
+    response_model=Metrics
+)
+async def get_help_metrics():
+
+    return {
+        "caches": cache_stats(),
+        "resources": resources.stats()
+    }
+
+@app.post(
+    "/admin/reloadScores",
+    description="Load the precomputed similarity scores again if their file has changed, or always if force is true. The requests in progress finish with the previous scores",
+    status_code=200,
+    response_model=ScoresInfo
+)
+async def post_admin_reload_scores(force:bool = False):
+
+    return await run_in_executor(reload_scores_info,force)
+
+def reload_scores_info(force:bool) -> dict:
+
+    reloaded = reload_scores(force)
+    scores = get_scores()
+    return {
+        "reloaded": reloaded,
+        "scores": len(scores),
+        "synsets": len(scores.names)
+    }
+
 @app.post(
     "/calculateDiversityOf",
     description="Obtain the diversity that is formed per  a set of users",
@@ -105,37 +217,23 @@ async def get_help_info():
 )
 async def post_calculate_diversity_of(data:AgentsData):
 
+    return await run_in_executor(calculate_diversity_of,data)
+
+def calculate_diversity_of(data:AgentsData) -> dict:
+
     users_diversity = 0.0
     try:
-        reqattr = []
-        for attrName in data.quantitativeAttributes:
-            
-            reqattr.append(Attribute(attrName,QN,[0,1]))
-    
-        for attrName in data.qualitativeAttributes:
-            
-            reqattr.append(Attribute(attrName,QL,data.qualitativeAttributes[attrName]))
-    
+        reqattr = required_attributes(data)
         max = len(reqattr)
-        if max > 0:
-            
-            agents = []
+        if max > 0 and len(data.agents) > 0:
+            # The qualitative attributes of the agents must be defined, as the diversity is 0 if not
             for agentData in data.agents:
-                agent_attributes = []
-                for attrName in agentData.quantitativeAttributes:
-                
-                    agent_attributes.append(Attribute(attrName,QN,[0,1],agentData.quantitativeAttributes[attrName]))
-        
                 for attrName in agentData.qualitativeAttributes:
-                
-                    agent_attributes.append(Attribute(attrName,QL,data.qualitativeAttributes[attrName],agentData.qualitativeAttributes[attrName]))
-        
-                agents.append(Agent(agentData.id,agent_attributes))
-                
-            if len(agents) > 0:
-                # Calculate the diversity of the agents
-                users_diversity = diversity(agents,reqattr)
-                users_diversity /= max # To normalize on the range [0,1]
+                    if attrName not in data.qualitativeAttributes:
+                        raise KeyError(attrName)
+            # Calculate the diversity of the agents
+            users_diversity = TeamMatrix(reqattr,attribute_columns(data.agents,reqattr)).diversity()
+            users_diversity /= max # To normalize on the range [0,1]
     except:
         #Ignore exceptions
         users_diversity = 0.0                
@@ -143,24 +241,132 @@ async def post_calculate_diversity_of(data:AgentsData):
         "value": users_diversity
     } 
 
+@app.post(
+    "/calculateDiversityOfBatch",
+    description="Obtain the diversity of some teams formed from a set of users",
+    status_code=200,
+    response_model=Diversities
+)
+async def post_calculate_diversity_of_batch(data:TeamsData):
+
+    return await run_in_executor(calculate_diversity_of_batch,data)
+
+def calculate_diversity_of_batch(data:TeamsData) -> dict:
+
+    teams_diversity = [0.0] * len(data.teams)
+    try:
+        reqattr = required_attributes(data)
+        max = len(reqattr)
+        if max > 0:
+            # The agents without a valid value for any attribute can not be on a team
+            agents = [agentData for agentData in data.agents if is_complete(agentData,data)]
+            positions = {agentData.id: i for i,agentData in enumerate(agents)}
+            valid = [i for i,team in enumerate(data.teams) if len(team) > 0 and all(id in positions for id in team)]
+            if len(valid) > 0:
+                matrix = TeamMatrix(reqattr,attribute_columns(agents,reqattr))
+                values = matrix.batchDiversity([[positions[id] for id in data.teams[i]] for i in valid])
+                for i,value in zip(valid,values):
+                    teams_diversity[i] = value / max # To normalize on the range [0,1]
+    except:
+        #Ignore exceptions
+        teams_diversity = [0.0] * len(data.teams)
+    return {
+        "values": teams_diversity
+    }
+
+@app.post(
+    "/findDiverseTeams",
+    description="Search the most diverse teams of a size that can be formed from a set of users",
+    status_code=200,
+    response_model=DiverseTeams
+)
+async def post_find_diverse_teams(data:DiverseTeamsData):
+
+    return await run_in_executor(find_diverse_teams,data)
+
+def find_diverse_teams(data:DiverseTeamsData) -> dict:
+
+    diverse_teams = []
+    try:
+        reqattr = required_attributes(data)
+        max = len(reqattr)
+        if max > 0:
+            agents = []
+            schema = AttributeSchema.of(reqattr)
+            for agentData in data.agents:
+                if is_complete(agentData,data):
+                    agent_attributes = []
+                    for attr in reqattr:
+                        values = agentData.qualitativeAttributes if attr.type == QL else agentData.quantitativeAttributes
+                        agent_attributes.append(Attribute(attr.id,attr.type,attr.range,values[attr.id]))
+
+                    agents.append(Agent(agentData.id,agent_attributes,schema))
+
+            for team,value in findDiverseTeams(agents,reqattr,data.teamSize,count=data.maxTeams,budget=data.timeBudget):
+                diverse_teams.append({"agents":[agent.id for agent in team],"diversity":value / max})
+    except:
+        #Ignore exceptions
+        diverse_teams = []
+    return {
+        "teams": diverse_teams
+    }
+
+def required_attributes(data:AgentsData) -> List[Attribute]:
+    """Return the attributes to calculate the diversity of some agents"""
+    reqattr = []
+    for attrName in data.quantitativeAttributes:
+
+        reqattr.append(Attribute(attrName,QN,[0,1]))
+
+    for attrName in data.qualitativeAttributes:
+
+        reqattr.append(Attribute(attrName,QL,data.qualitativeAttributes[attrName]))
+    return reqattr
+
+def attribute_columns(agents:List[AgentData],reqattr:List[Attribute]) -> List[list]:
+    """Return the values of each attribute for the agents"""
+    columns = []
+    for attr in reqattr:
+        if attr.type == QL:
+            columns.append([agentData.qualitativeAttributes.get(attr.id) for agentData in agents])
+        else:
+            columns.append([agentData.quantitativeAttributes.get(attr.id) for agentData in agents])
+    return columns
+
+def is_complete(agentData:AgentData,data:AgentsData) -> bool:
+    """Check if an agent has a valid value for all the attributes"""
+    for attrName in data.quantitativeAttributes:
+        if attrName not in agentData.quantitativeAttributes:
+            return False
+    for attrName in data.qualitativeAttributes:
+        if agentData.qualitativeAttributes.get(attrName) not in data.qualitativeAttributes[attrName]:
+            return False
+    return True
+
 @app.post(
     "/calculateSimilarityOf",
     description="Obtain the similarity between some attributes and some text",
     status_code=200,
     response_model=Similarities
 )
-async def post_calculate_similarity_of(data:AttributesData):
+async def post_calculate_similarity_of(data:RankedAttributesData):
+
+    return await run_in_executor(calculate_similarity_of,data)
+
+def calculate_similarity_of(data:RankedAttributesData) -> dict:
     
     attribute_similarities = []
     try:
         source_lang = detect_lang(data.source)
-        pattern_camel = re.compile(r'(?<!^)(?=[A-Z])')
-        pattern_word = re.compile(r'(\W|\.|_)')
-        for attribute in data.attributes:
-            normalized_attribute = pattern_camel.sub(' ',attribute).lower()
-            normalized_attribute = pattern_word.sub(' ',normalized_attribute)
-            sim = sim_str_str(data.source,normalized_attribute,source_lang,"en",data.aggregation)
-            attribute_similarities.append({"attribute":attribute,"similarity":sim})
+        normalized_attributes = [normalize_attribute(attribute) for attribute in data.attributes]
+        if data.topK is None and data.minSimilarity <= 0.0:
+            sims = sim_str_many(data.source,normalized_attributes,source_lang,"en",data.aggregation)
+            for attribute,sim in zip(data.attributes,sims):
+                attribute_similarities.append({"attribute":attribute,"similarity":sim})
+        else:
+            top = sim_str_top(data.source,normalized_attributes,source_lang,"en",data.aggregation,data.topK,data.minSimilarity)
+            for index,sim in top:
+                attribute_similarities.append({"attribute":data.attributes[index],"similarity":sim})
     except:
         #Ignore exceptions
         attribute_similarities = []                
@@ -169,3 +375,73 @@ async def post_calculate_similarity_of(data:AttributesData):
         "similarities": attribute_similarities
     } 
 
+@app.post(
+    "/calculateSimilarityOfStream",
+    description="Obtain the similarity between some attributes and some text, returning each attribute similarity on a JSON line as soon as it is calculated",
+    status_code=200,
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}}
+)
+async def post_calculate_similarity_of_stream(data:AttributesData):
+
+    lines = similarity_lines(data)
+    async def stream():
+        while True:
+            line = await run_in_executor(next,lines,None)
+            if line is None:
+                break
+            yield line
+    return StreamingResponse(stream(),media_type="application/x-ndjson")
+
+def similarity_lines(data:AttributesData):
+    """Generate the JSON line of each attribute similarity, stopping on the first error"""
+    try:
+        source_lang = detect_lang(data.source)
+        normalized_attributes = [normalize_attribute(attribute) for attribute in data.attributes]
+        sims = sim_str_iter(data.source,normalized_attributes,source_lang,"en",data.aggregation)
+        for attribute,sim in zip(data.attributes,sims):
+            yield json.dumps({"attribute":attribute,"similarity":sim}) + "\n"
+    except:
+        #Ignore exceptions, the similarities already sent are kept
+        return
+
+@app.post(
+    "/calculateProfilesAffinity",
+    description="Obtain the affinity between each pair of some profiles, as the similarity of their attributes",
+    status_code=200,
+    response_model=ProfilesAffinity
+)
+async def post_calculate_profiles_affinity(data:ProfilesData):
+
+    return await run_in_executor(calculate_profiles_affinity,data)
+
+def calculate_profiles_affinity(data:ProfilesData) -> dict:
+
+    affinities = []
+    try:
+        attrlsts = [list(profile.attributes.items()) for profile in data.profiles]
+        affinities = sim_attrlst_matrix(attrlsts,stat=data.aggregation).tolist()
+    except:
+        #Ignore exceptions
+        affinities = []
+
+    return {
+        "profiles": [profile.id for profile in data.profiles],
+        "affinities": affinities
+    }
+
+@app.on_event("startup")
+def warm_attributes():
+    """Lemmatize the attributes defined on the file ATTRIBUTES_PATH, one per line"""
+    attributes_file = os.getenv('ATTRIBUTES_PATH')
+    if attributes_file is not None and os.path.isfile(attributes_file):
+        with open(attributes_file) as f:
+            attributes = [normalize_attribute(line.strip()) for line in f if line.strip() != ""]
+        warm_attribute_synsets(attributes,"en")
+
+@app.on_event("startup")
+def watch_scores_file():
+    """Reload the scores when their file changes, checking it every SCORES_RELOAD_INTERVAL seconds"""
+    interval = float(os.getenv('SCORES_RELOAD_INTERVAL',"0"))
+    if interval > 0:
+        watch_scores(interval)
@@ -0,0 +1,126 @@
+#
+# Copyright 2019 - 2022 UDT-IA, IIIA-CSIC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+import time
+
+
+class ResourceManager:
+    """
+    Registry of the resources (models, dictionaries, ...) that are loaded the
+    first time they are used.
+
+    The resources can also be preloaded, for example on the gunicorn master
+    before forking the workers so they share the memory of the resources,
+    and the time spent loading each one is recorded.
+    """
+
+    def __init__(self):
+        self.loaders = {}
+        self.resources = {}
+        self.load_times = {}
+        self.instances = {}
+        self.per_thread = set()
+        self.local = threading.local()
+        self.lock = threading.RLock()
+
+    def register(self, name: str, loader, per_thread: bool = False):
+        """
+        Registers the function without arguments that loads a resource. The
+        resources that are not thread safe can be loaded once per thread.
+        """
+        self.loaders[name] = loader
+        self.instances[name] = 0
+        if per_thread:
+            self.per_thread.add(name)
+
+    def _resources(self, name: str) -> dict:
+        """Returns the loaded resources visible from the current thread"""
+        if name not in self.per_thread:
+            return self.resources
+        try:
+            return self.local.resources
+        except AttributeError:
+            self.local.resources = {}
+            return self.local.resources
+
+    def get(self, name: str):
+        """Returns a resource, loading it if it is not loaded yet"""
+        resources = self._resources(name)
+        try:
+            return resources[name]
+        except KeyError:
+            pass
+        with self.lock:
+            if name not in resources:
+                if name not in self.loaders:
+                    raise KeyError("Resource not registered: " + str(name))
+                start = time.monotonic()
+                resource = self.loaders[name]()
+                self.load_times[name] = time.monotonic() - start
+                self.instances[name] += 1
+                resources[name] = resource
+                print("Loaded " + name + " in " + str(round(self.load_times[name], 3)) + "s")
+            return resources[name]
+
+    def reload(self, name: str):
+        """
+        Loads again a resource and replaces the loaded one when it is loaded,
+        so while it is loading the previous one can still be used. Returns the
+        new resource.
+        """
+        if name not in self.loaders:
+            raise KeyError("Resource not registered: " + str(name))
+        start = time.monotonic()
+        resource = self.loaders[name]()
+        load_time = time.monotonic() - start
+        with self.lock:
+            self.load_times[name] = load_time
+            self.instances[name] += 1
+            self._resources(name)[name] = resource
+        print("Reloaded " + name + " in " + str(round(load_time, 3)) + "s")
+        return resource
+
+    def set(self, name: str, resource):
+        """Replaces a loaded resource, the users that already have it keep the previous one"""
+        self._resources(name)[name] = resource
+
+    def is_loaded(self, name: str) -> bool:
+        """Checks if a resource is loaded, for the current thread if it is loaded per thread"""
+        return name in self._resources(name)
+
+    def preload(self, names=None):
+        """
+        Loads some resources. The names can be a list or a comma separated
+        string, where "all" or None means all the registered resources.
+        """
+        if names is None or names == "all":
+            names = list(self.loaders)
+        elif isinstance(names, str):
+            names = [name.strip() for name in names.split(",") if name.strip() != ""]
+        for name in names:
+            self.get(name)
+
+    def stats(self) -> dict:
+        """
+        Returns for each resource the number of instances loaded (one per
+        thread for the resources loaded per thread) and the seconds spent
+        loading the last one.
+        """
+        return {
+            name: {"instances": self.instances[name], "loadTime": self.load_times.get(name)}
+            for name in self.loaders
+        }
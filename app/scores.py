@@ -0,0 +1,207 @@
+#
+# Copyright 2019 - 2022 UDT-IA, IIIA-CSIC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import argparse
+import marshal
+import os
+
+import numpy as np
+
+# Alignment in bytes of each array stored on a score file
+ALIGNMENT = 64
+
+
+def pair_keys(ids1, ids2):
+    """
+    Returns the keys of the unordered pairs of synset identifiers.
+
+    The smallest identifier of each pair is stored on the upper 32 bits of
+    the key and the other on the lower ones.
+    """
+    ids1 = np.asarray(ids1, dtype=np.int64)
+    ids2 = np.asarray(ids2, dtype=np.int64)
+    return (np.minimum(ids1, ids2) << 32) | np.maximum(ids1, ids2)
+
+
+class ScoreStore:
+    """
+    Precomputed similarity scores between pairs of synsets.
+
+    The synset names are interned to integer identifiers, and the scores are
+    stored as a sorted array of pair keys (see pair_keys) with the array of
+    their float32 scores. The arrays of a loaded store are memory mapped, so
+    all the processes that load the same file share its pages.
+    """
+
+    def __init__(self, names=(), keys=None, values=None):
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.keys = np.empty(0, dtype=np.int64) if keys is None else keys
+        self.values = np.empty(0, dtype=np.float32) if values is None else values
+
+    def __len__(self):
+        return len(self.keys)
+
+    def id(self, name: str) -> int:
+        """Returns the identifier of a synset name, or -1 if it is unknown"""
+        return self.index.get(name, -1)
+
+    def ids(self, names) -> np.ndarray:
+        """Returns the identifiers of some synset names, -1 for the unknown ones"""
+        return np.array([self.index.get(name, -1) for name in names], dtype=np.int64)
+
+    def score(self, id1: int, id2: int):
+        """Returns the score of a pair of synset identifiers, or None if it is not stored"""
+        if id1 < 0 or id2 < 0 or len(self.keys) == 0:
+            return None
+        key = pair_keys(id1, id2)
+        pos = np.searchsorted(self.keys, key)
+        if pos < len(self.keys) and self.keys[pos] == key:
+            return float(self.values[pos])
+        return None
+
+    def lookup(self, ids1, ids2) -> np.ndarray:
+        """
+        Returns the matrix with the scores between each identifier of ids1
+        (rows) and each identifier of ids2 (columns), where the pairs that
+        are not stored are NaN.
+        """
+        ids1 = np.asarray(ids1, dtype=np.int64).reshape(-1, 1)
+        ids2 = np.asarray(ids2, dtype=np.int64).reshape(1, -1)
+        matrix = np.full((ids1.shape[0], ids2.shape[1]), np.nan)
+        if len(self.keys) == 0 or matrix.size == 0:
+            return matrix
+        keys = pair_keys(ids1, ids2)
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        found = (ids1 >= 0) & (ids2 >= 0) & (self.keys[pos] == keys)
+        matrix[found] = self.values[pos[found]]
+        return matrix
+
+    def get(self, name1: str, name2: str):
+        """Returns the score of a pair of synset names, or None if it is not stored"""
+        return self.score(self.id(name1), self.id(name2))
+
+    @classmethod
+    def fromDict(cls, scores: dict):
+        """
+        Creates a store from a dictionary of scores keyed by the frozenset of
+        the names of the synsets, as the ones stored on the marshal files.
+        """
+        names = sorted(set(name for pair in scores for name in pair))
+        index = {name: i for i, name in enumerate(names)}
+        ids1 = np.empty(len(scores), dtype=np.int64)
+        ids2 = np.empty(len(scores), dtype=np.int64)
+        values = np.empty(len(scores), dtype=np.float32)
+        for i, (pair, score) in enumerate(scores.items()):
+            pair = sorted(pair)
+            ids1[i] = index[pair[0]]
+            ids2[i] = index[pair[-1]]
+            values[i] = 0 if score is None else score
+        keys = pair_keys(ids1, ids2)
+        order = np.argsort(keys, kind="stable")
+        return cls(names, keys[order], values[order])
+
+    @classmethod
+    def load(cls, path: str):
+        """Loads a store saved with save, memory mapping its scores"""
+        arrays = []
+        with open(path, "rb") as f:
+            for _ in range(3):
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+                offset = f.tell()
+                size = int(np.prod(shape)) * dtype.itemsize
+                if size == 0:
+                    arrays.append(np.empty(shape, dtype=dtype))
+                else:
+                    arrays.append(np.memmap(f, dtype=dtype, mode="r", offset=offset, shape=shape))
+                f.seek(_aligned(offset + size))
+        names = [name.decode("utf-8") for name in arrays[0]]
+        return cls(names, arrays[1], arrays[2])
+
+    def save(self, path: str):
+        """
+        Saves the store on a file, formed by the arrays of names, keys and
+        values on the npy format. The file is replaced atomically, so the
+        processes that are reading the previous one are not affected.
+        """
+        names = np.array([name.encode("utf-8") for name in self.names], dtype=bytes)
+        if len(names) == 0:
+            names = np.empty(0, dtype="S1")
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            for array in (names, np.asarray(self.keys, dtype=np.int64), np.asarray(self.values, dtype=np.float32)):
+                np.lib.format.write_array(f, np.ascontiguousarray(array), allow_pickle=False)
+                f.write(b"\0" * (_aligned(f.tell()) - f.tell()))
+        os.replace(tmp, path)
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def merge(stores) -> ScoreStore:
+    """
+    Merges some stores on a new one with all their synsets and scores. If a
+    pair is on more than one store its score is taken from the last one.
+    """
+    names = sorted(set(name for store in stores for name in store.names))
+    index = {name: i for i, name in enumerate(names)}
+    keys = [np.empty(0, dtype=np.int64)]
+    values = [np.empty(0, dtype=np.float32)]
+    for store in stores:
+        # The identifiers change, so the keys are formed again
+        ids = np.array([index[name] for name in store.names], dtype=np.int64)
+        store_keys = np.asarray(store.keys, dtype=np.int64)
+        keys.append(pair_keys(ids[store_keys >> 32], ids[store_keys & 0xFFFFFFFF]))
+        values.append(np.asarray(store.values, dtype=np.float32))
+    keys = np.concatenate(keys)
+    values = np.concatenate(values)
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    values = values[order]
+    last = np.append(keys[1:] != keys[:-1], True)[:len(keys)]
+    return ScoreStore(names, keys[last], values[last])
+
+
+def migrate(marshal_path: str, path: str) -> ScoreStore:
+    """Converts a scores marshal file to a score store file"""
+    with open(marshal_path, "rb") as f:
+        store = ScoreStore.fromDict(marshal.load(f))
+    store.save(path)
+    return store
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Manage the precomputed similarity scores between synsets.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_migrate = subparsers.add_parser("migrate", help="Convert a scores marshal file to a score store file.")
+    parser_migrate.add_argument("input", help="The scores marshal file to convert.")
+    parser_migrate.add_argument("output", help="The score store file to write.")
+    parser_merge = subparsers.add_parser("merge", help="Merge some score store files, taking the scores of the pairs that are on more than one from the last file.")
+    parser_merge.add_argument("inputs", nargs="+", help="The score store files to merge.")
+    parser_merge.add_argument("output", help="The score store file to write, that can be one of the inputs.")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        store = migrate(args.input, args.output)
+    elif args.command == "merge":
+        store = merge([ScoreStore.load(path) for path in args.inputs])
+        store.save(args.output)
+    print(str(len(store)) + " scores of " + str(len(store.names)) + " synsets written to " + args.output)
@@ -0,0 +1,114 @@
+#
+# Copyright 2019 - 2022 UDT-IA, IIIA-CSIC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import numpy as np
+import os
+import pytest
+import build_scores as builder
+from build_scores import build_scores, chunk_path, chunks, extract_vocabulary, prepare_checkpoint, remove_checkpoint, save_chunk, score_rows
+from nltk.corpus import wordnet as wn
+from scores import ScoreStore, pair_keys
+from WNS import path_score
+
+
+@pytest.mark.timeout(30)
+def test_chunks():
+    """Test the split of the upper triangle on chunks of rows"""
+    ranges = chunks(5, 6)
+    assert ranges == [(0, 2), (2, 5)]
+    assert chunks(5, 1000) == [(0, 5)]
+    assert chunks(0, 10) == []
+    assert sum(5 - row for start, end in chunks(5, 2) for row in range(start, end)) == 15
+
+
+@pytest.mark.timeout(30)
+def test_extract_vocabulary():
+    """Test extract the synsets of some texts"""
+    names = extract_vocabulary(["Do you have a bike?", "car vehicle"], "en")
+    assert names == sorted(set(names))
+    assert "bicycle.n.01" in names
+
+
+@pytest.mark.timeout(60)
+def test_score_rows(monkeypatch):
+    """Test that the rows of a chunk are scored only with them and the following synsets"""
+    names = ["bicycle.n.01", "car.n.01", "motor_vehicle.n.01", "vehicle.n.01"]
+    monkeypatch.setattr(builder, "vocabulary", [wn.synset(name) for name in names])
+    keys, values = score_rows(1, 3)
+    assert list(keys) == list(pair_keys([1, 1, 1, 2, 2], [1, 2, 3, 2, 3]))
+    for key, value in zip(keys, values):
+        name1, name2 = names[int(key) >> 32], names[int(key) & 0xFFFFFFFF]
+        assert abs(value - path_score(wn.synset(name1), wn.synset(name2))) < 1e-6
+
+
+@pytest.mark.timeout(120)
+def test_build_scores(tmp_path):
+    """Test build the scores of a vocabulary"""
+    names = ["bicycle.n.01", "car.n.01", "motor_vehicle.n.01", "vehicle.n.01"]
+    path = str(tmp_path / "scores.store")
+    store = build_scores(names, path, processes=2, chunk_pairs=3)
+    assert len(store) == 10
+    loaded = ScoreStore.load(path)
+    for name1 in names:
+        for name2 in names:
+            assert abs(loaded.get(name1, name2) - path_score(wn.synset(name1), wn.synset(name2))) < 1e-6
+    assert not os.path.exists(path + ".chunks")
+
+
+@pytest.mark.timeout(120)
+def test_build_scores_resumes_from_checkpoint(tmp_path):
+    """Test that the chunks already computed are not computed again"""
+    names = ["bicycle.n.01", "car.n.01", "vehicle.n.01"]
+    path = str(tmp_path / "scores.store")
+    checkpoint = str(tmp_path / "checkpoint")
+    prepare_checkpoint(checkpoint, names)
+    assert chunks(len(names), 3) == [(0, 1), (1, 3)]
+    save_chunk(chunk_path(checkpoint, 0, 1), pair_keys([0, 0, 0], [0, 1, 2]), np.array([0.5, 0.5, 0.5], dtype=np.float32))
+    store = build_scores(names, path, checkpoint, processes=1, chunk_pairs=3)
+    assert store.get("bicycle.n.01", "bicycle.n.01") == 0.5
+    assert store.get("car.n.01", "car.n.01") == 1.0
+    assert not os.path.exists(checkpoint)
+    prepare_checkpoint(checkpoint, names)
+    with pytest.raises(ValueError):
+        prepare_checkpoint(checkpoint, names[1:])
+
+
+@pytest.mark.timeout(30)
+def test_remove_checkpoint_keeps_other_files(tmp_path):
+    """Test that only the files created by the build are removed from the checkpoint"""
+    checkpoint = str(tmp_path)
+    (tmp_path / "notes.txt").write_text("keep")
+    prepare_checkpoint(checkpoint, ["car.n.01"])
+    save_chunk(chunk_path(checkpoint, 0, 1), pair_keys([0], [0]), np.array([1.0], dtype=np.float32))
+    remove_checkpoint(checkpoint)
+    assert sorted(os.listdir(checkpoint)) == ["notes.txt"]
+
+
+@pytest.mark.timeout(120)
+def test_build_scores_incremental(tmp_path):
+    """Test add the scores of new synsets to the stored ones"""
+    path = str(tmp_path / "scores.store")
+    build_scores(["bicycle.n.01", "car.n.01"], path, processes=1)
+    store = ScoreStore.load(path)
+    store.values = np.full(len(store), 0.5, dtype=np.float32)
+    store.save(path)
+    merged = build_scores(["car.n.01", "vehicle.n.01", "ant.n.01"], path, processes=1, incremental=True)
+    assert merged.names == ["ant.n.01", "bicycle.n.01", "car.n.01", "vehicle.n.01"]
+    assert len(merged) == 10
+    assert merged.get("bicycle.n.01", "car.n.01") == 0.5
+    assert merged.get("car.n.01", "car.n.01") == 0.5
+    assert abs(merged.get("car.n.01", "vehicle.n.01") - path_score(wn.synset("car.n.01"), wn.synset("vehicle.n.01"))) < 1e-6
+    assert merged.get("vehicle.n.01", "vehicle.n.01") == 1.0
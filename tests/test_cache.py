@@ -0,0 +1,55 @@
+#
+# Copyright 2019 - 2022 UDT-IA, IIIA-CSIC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import pytest
+from cache import LRUCache
+
+
+@pytest.mark.timeout(30)
+def test_lru_cache_evicts_least_recently_used():
+    """Test that the cache evicts the least recently used entries"""
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+@pytest.mark.timeout(30)
+def test_lru_cache_stats():
+    """Test the counters of the cache"""
+    cache = LRUCache(1)
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("b")
+    cache.put("b", 2)
+    assert cache.stats() == {"size": 1, "maxSize": 1, "hits": 1, "misses": 1, "evictions": 1, "hitRate": 0.5}
+    cache.clear()
+    assert cache.stats() == {"size": 0, "maxSize": 1, "hits": 0, "misses": 0, "evictions": 0, "hitRate": 0.0}
+
+
+@pytest.mark.timeout(30)
+def test_lru_cache_disabled():
+    """Test that a cache without size does not store anything"""
+    cache = LRUCache(0)
+    cache.put("a", 1)
+    assert cache.get("a", 0) == 0
+    assert len(cache) == 0
@@ -14,8 +14,10 @@
 # limitations under the License.
 #
 
+import numpy as np
 import pytest
-from diversity import Agent, Attribute, QN, diversity
+import diversity as diversity_module
+from diversity import Agent, Attribute, AttributeSchema, QN, QL, TeamDiversityState, TeamMatrix, buildEquivalenceIndex, changeDiversity, diversity, findDiverseTeams, findEquivalentAgents
 
 
 @pytest.mark.timeout(30)
@@ -115,3 +117,154 @@ def test_calculate_diversity_for_domain_studying_career():
         ]
     div = diversity(agents, reqattr)
     assert  div == 1.5999999999999999
+
+
+@pytest.mark.timeout(30)
+def test_calculate_diversity_for_qualitative_agents():
+    """Test the diversity over two agents with qualitative attributes"""
+    agents = [
+        Agent("1234", [
+            Attribute("gender", QL, ["M", "F", "O"], "M"),
+            Attribute("civilStatus", QL, ["single", "married", "divorced", "widow"], "single")
+            ]),
+        Agent("abcd", [
+            Attribute("gender", QL, ["M", "F", "O"], "F"),
+            Attribute("civilStatus", QL, ["single", "married", "divorced", "widow"], "single")
+            ])
+    ]
+    reqattr = [Attribute("gender", QL, ["M", "F", "O"]), Attribute("civilStatus", QL, ["single", "married", "divorced", "widow"])]
+    div = diversity(agents, reqattr)
+    assert abs(div - np.log(2) / np.log(3)) < 1e-12
+
+
+@pytest.mark.timeout(30)
+def test_team_matrix_from_columns():
+    """Test the diversity of a team defined by the columns of its attribute values"""
+    reqattr = [Attribute("introvert", QN, [0, 1]), Attribute("gender", QL, ["M", "F", "O"])]
+    matrix = TeamMatrix(reqattr, [[1.0, 0.0, 0.5], ["M", "F", "O"]])
+    assert len(matrix) == 3
+    values = matrix.attributeDiversity()
+    assert abs(values[0] - np.std([1.0, 0.0, 0.5])) < 1e-12
+    assert abs(values[1] - 1.0) < 1e-12
+    assert abs(matrix.diversity() - values[0] - values[1]) < 1e-12
+
+
+@pytest.mark.timeout(30)
+def test_team_matrix_with_undefined_values():
+    """Test that a team with undefined values can not be represented"""
+    reqattr = [Attribute("introvert", QN, [0, 1]), Attribute("gender", QL, ["M", "F", "O"])]
+    with pytest.raises(ValueError):
+        TeamMatrix(reqattr, [[1.0, None], ["M", "F"]])
+    with pytest.raises(KeyError):
+        TeamMatrix(reqattr, [[1.0, 0.0], ["M", "X"]])
+
+
+@pytest.mark.timeout(30)
+def test_agent_get_value():
+    """Test obtain the values of the attributes of an agent"""
+    agent = Agent("1234", [
+        Attribute("property1", QN, [0, 1], 0.3),
+        Attribute("gender", QL, ["M", "F", "O"], "F"),
+        Attribute("property1", QN, [0, 1], 0.7)
+        ])
+    assert agent.getValue(Attribute("property1", QN, [0, 1])) == 0.3
+    assert agent.getValue(Attribute("gender", QL, ["M", "F", "O"])) == "F"
+    assert agent.getValue(Attribute("undefined", QN, [0, 1])) is None
+    assert agent.getValue("property1") is None
+    assert not hasattr(agent, "__dict__")
+    other = Agent("5678", [
+        Attribute("property1", QN, [0, 1], 0.5),
+        Attribute("gender", QL, ["M", "F", "O"], "M"),
+        Attribute("property1", QN, [0, 1], 0.1)
+        ])
+    assert other.schema is agent.schema
+    assert other.getValue(Attribute("property1", QN, [0, 1])) == 0.5
+    assert Agent("9", [Attribute("gender", QL, ["M", "F", "O"], "O")]).getValue(Attribute("gender", QL, ["M", "F", "O"])) == "O"
+    assert agent == Agent("1234", []) and hash(agent) == hash("1234")
+    third = Agent("abcd", [Attribute("property1", QN, [0, 1], 0.2), Attribute("gender", QL, ["M", "F", "O"], "O"), Attribute("property1", QN, [0, 1], 0.4)])
+    assert third.schema is agent.schema
+    schema = AttributeSchema(["gender"])
+    given = Agent("efgh", [Attribute("gender", QL, ["M", "F", "O"], "M")], schema)
+    assert given.schema is schema and given.getValue(Attribute("gender", QL, ["M", "F", "O"])) == "M"
+
+
+def _team_agent(id, introvert, gender):
+    return Agent(id, [Attribute("introvert", QN, [0, 1], introvert), Attribute("gender", QL, ["M", "F", "O"], gender)])
+
+
+@pytest.mark.timeout(30)
+def test_team_diversity_state_swap():
+    """Test the change of diversity when swapping a member of a team"""
+    reqattr = [Attribute("introvert", QN, [0, 1]), Attribute("gender", QL, ["M", "F", "O"])]
+    team = [_team_agent("1", 0.0, "M"), _team_agent("2", 0.5, "M"), _team_agent("3", 1.0, "F")]
+    other = _team_agent("4", 0.2, "O")
+    state = TeamDiversityState(team, reqattr)
+    assert abs(state.diversity() - diversity(team, reqattr)) < 1e-12
+    new_team = [team[0], other, team[2]]
+    delta = state.swapDelta(team[1], other)
+    assert abs(delta - (diversity(new_team, reqattr) - diversity(team, reqattr))) < 1e-12
+    state.swap(team[1], other)
+    assert other in state
+    assert team[1] not in state
+    assert abs(state.diversity() - diversity(new_team, reqattr)) < 1e-12
+
+
+@pytest.mark.timeout(30)
+def test_change_diversity():
+    """Test the alternative teams obtained by swapping equivalent agents"""
+    attr = Attribute("gender", QL, ["M", "F", "O"])
+    team = [_team_agent("1", 0.0, "M"), _team_agent("2", 0.5, "M")]
+    others = [_team_agent("3", 0.0, "F"), _team_agent("4", 0.0, "M")]
+    team[1].equivalent[attr] = others
+    alternatives = changeDiversity(team, attr, epsilon=-0.1, positive=False)
+    assert alternatives == [[team[0], others[0]]]
+    alternatives = changeDiversity(team, attr, epsilon=0.1, positive=False)
+    assert alternatives == [[team[0], others[0]], [team[0], others[1]]]
+
+
+@pytest.mark.timeout(30)
+def test_build_equivalence_index():
+    """Test that the equivalence index matches the pairwise equivalences"""
+    reqattr = [Attribute("introvert", QN, [0, 1]), Attribute("extrovert", QN, [0, 1]), Attribute("gender", QL, ["M", "F", "O"])]
+    agents = []
+    for i in range(40):
+        agents.append(Agent(str(i), [
+            Attribute("introvert", QN, [0, 1], (i % 7) * 0.05),
+            Attribute("extrovert", QN, [0, 1], (i % 5) * 0.1),
+            Attribute("gender", QL, ["M", "F", "O"], ["M", "F", "O"][i % 3])
+            ]))
+    buildEquivalenceIndex(agents, reqattr, epsilon=0.1)
+    for agent in agents:
+        for attr in reqattr:
+            assert agent.equivalent[attr] == findEquivalentAgents(agent, attr, agents, reqattr=reqattr, epsilon=0.1)
+
+
+@pytest.mark.timeout(30)
+def test_team_matrix_batch_diversity():
+    """Test the diversity of several teams formed from the same agents"""
+    reqattr = [Attribute("introvert", QN, [0, 1]), Attribute("gender", QL, ["M", "F", "O"])]
+    columns = [[1.0, 0.0, 0.5, 0.2], ["M", "F", "O", "M"]]
+    matrix = TeamMatrix(reqattr, columns)
+    teams = [[0, 1], [0, 1, 2], [3], [3, 0, 2]]
+    values = matrix.batchDiversity(teams)
+    assert len(values) == len(teams)
+    for team, value in zip(teams, values):
+        expected = TeamMatrix(reqattr, [[column[i] for i in team] for column in columns]).diversity()
+        assert abs(value - expected) < 1e-12
+    with pytest.raises(ValueError):
+        matrix.batchDiversity([[0, 1], []])
+
+
+@pytest.mark.timeout(30)
+def test_find_diverse_teams(monkeypatch):
+    """Test that the local search finds the most diverse teams"""
+    reqattr = [Attribute("introvert", QN, [0, 1]), Attribute("gender", QL, ["M", "F", "O"])]
+    agents = [_team_agent(str(i), (i * 7 % 11) / 10, ["M", "F", "O"][i % 3]) for i in range(12)]
+    exhaustive = findDiverseTeams(agents, reqattr, 3, count=2)
+    assert len(exhaustive) == 2
+    assert exhaustive[0][1] >= exhaustive[1][1]
+    monkeypatch.setattr(diversity_module, "EXHAUSTIVE_LIMIT", 0)
+    search = findDiverseTeams(agents, reqattr, 3, count=1, budget=1.0, seed=0)
+    assert search[0][0] == exhaustive[0][0]
+    assert abs(search[0][1] - exhaustive[0][1]) < 1e-12
+    assert findDiverseTeams(agents, reqattr, 13) == []
@@ -0,0 +1,72 @@
+#
+# Copyright 2019 - 2022 UDT-IA, IIIA-CSIC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import pytest
+from hypernyms import AncestorIndex, HypernymIndex
+from nltk.corpus import wordnet as wn
+from WNS import get_hypernyms
+
+NAMES = ["dog.n.01", "cat.n.01", "paris.n.01", "city.n.01", "entity.n.01", "bicycle.n.01", "run.v.01", "be.v.01", "travel.v.01", "good.a.01", "quickly.r.01"]
+
+
+@pytest.mark.timeout(120)
+def test_path_similarity_as_nltk():
+    """Test that the path similarity is the same as the one of NLTK"""
+    index = get_hypernyms()
+    for name1 in NAMES:
+        for name2 in NAMES:
+            assert index.path_similarity(name1, name2) == wn.synset(name1).path_similarity(wn.synset(name2))
+    assert index.path_similarity("dog.n.01", "undefined.n.01") is None
+
+
+@pytest.mark.timeout(120)
+def test_distance_matrix_with_root_of_first(tmp_path):
+    """Test the distances simulating the root only for the first synset, as NLTK before 3.6"""
+    path = str(tmp_path / "hypernyms.index")
+    get_hypernyms().save(path)
+    index = HypernymIndex.load(path, root_of_both=False)
+    assert index.names == get_hypernyms().names
+    distances = index.distance_matrix(index.ids(NAMES + ["undefined.n.01"]), index.ids(NAMES))
+    for i, name1 in enumerate(NAMES):
+        for j, name2 in enumerate(NAMES):
+            synset1 = wn.synset(name1)
+            distance = synset1.shortest_path_distance(wn.synset(name2), simulate_root=synset1._needs_root())
+            assert distances[i, j] == (-1 if distance is None else distance)
+    assert (distances[-1] == -1).all()
+
+
+@pytest.mark.timeout(120)
+def test_ancestor_index_candidates():
+    """Test that the candidates include all the items with a synset at a distance of at most the depth"""
+    hypernyms = get_hypernyms()
+    for depth in [1, 2, 3]:
+        index = AncestorIndex(hypernyms, depth)
+        for name in NAMES:
+            index.add(name, [name])
+        index.add("undefined", ["undefined.n.01"])
+        distances = hypernyms.distance_matrix(hypernyms.ids(NAMES), hypernyms.ids(NAMES))
+        for i, name in enumerate(NAMES):
+            candidates = index.candidates([name])
+            assert "undefined" in candidates
+            for j, other in enumerate(NAMES):
+                if 0 <= distances[i, j] <= depth:
+                    assert other in candidates
+        assert index.candidates(["undefined.n.01"]) is None
+    assert "dog.n.01" in index and len(index) == len(NAMES) + 1
+    index = AncestorIndex(hypernyms, 2)
+    index.add("dog", ["dog.n.01"])
+    index.add("bicycle", ["bicycle.n.01"])
+    assert index.candidates(["dog.n.01"]) == {"dog"}
@@ -15,12 +15,15 @@
 #
 
 import json
+import numpy as np
+import os
 import pytest
 import uuid
 
 from fastapi.testclient import TestClient
 from main import app
 from pytest_httpserver import HTTPServer
+from scores import ScoreStore
 
 client = TestClient(app)
 
@@ -38,6 +41,42 @@ def test_get_help_info():
     assert 'license' in body
 
 
+@pytest.mark.timeout(30)
+def test_get_help_metrics():
+    """Test get the metrics of the caches and the resources"""
+    response = client.get("/help/metrics")
+    assert response.status_code == 200
+    body = response.json()
+    for name in ['similarities', 'attributeSynsets', 'lemmas', 'lemmaSynsets', 'languages']:
+        assert name in body['caches']
+        assert 0.0 <= body['caches'][name]['hitRate'] <= 1.0
+    assert 'scores' in body['resources']
+    assert body['resources']['scores']['instances'] >= 0
+
+
+@pytest.mark.timeout(30)
+def test_post_admin_reload_scores(tmp_path, monkeypatch):
+    """Test reload the scores when their file changes"""
+    path = str(tmp_path / "scores.store")
+    ScoreStore.fromDict({frozenset(["dog.n.01", "cat.n.01"]): 0.5}).save(path)
+    monkeypatch.setenv("SCORES_PATH", path)
+    try:
+        response = client.post("/admin/reloadScores")
+        assert response.status_code == 200
+        assert response.json() == {"reloaded": True, "scores": 1, "synsets": 2}
+        response = client.post("/admin/reloadScores")
+        assert response.json()["reloaded"] == False
+        ScoreStore.fromDict({frozenset(["dog.n.01", "cat.n.01"]): 0.5, frozenset(["dog.n.01"]): 1.0}).save(path)
+        os.utime(path, ns=(0, 0))
+        response = client.post("/admin/reloadScores")
+        assert response.json() == {"reloaded": True, "scores": 2, "synsets": 2}
+        response = client.post("/admin/reloadScores?force=true")
+        assert response.json()["reloaded"] == True
+    finally:
+        monkeypatch.undo()
+        client.post("/admin/reloadScores?force=true")
+
+
 @pytest.mark.timeout(30)
 def test_post_calculate_diversity_of():
     """Test calculate diversity of two agents"""
@@ -79,6 +118,35 @@ def test_post_calculate_diversity_of():
     assert response.json() == {"value":0.5261859507142914}
 
 
+@pytest.mark.timeout(30)
+def test_post_calculate_diversity_of_undefined_qualitative_attribute():
+    """Test that the diversity is 0 when an agent has a qualitative attribute that is not defined"""
+    data = {
+        "agents":[
+                {
+                    "id":"1",
+                    "quantitativeAttributes":{"introvert":1.0},
+                    "qualitativeAttributes":{"gender":"M", "civilStatus":"married"}
+                },
+                {
+                    "id":"2",
+                    "quantitativeAttributes":{"introvert":0.0},
+                    "qualitativeAttributes":{"gender":"F"}
+                }
+            ],
+        "qualitativeAttributes": {
+                "gender":["M", "F", "O"]
+            },
+        "quantitativeAttributes": ["introvert"]
+        }
+    response = client.post("/calculateDiversityOf", json=data)
+    assert response.status_code == 200
+    assert response.json() == {"value":0.0}
+    del data["agents"][0]["qualitativeAttributes"]["civilStatus"]
+    response = client.post("/calculateDiversityOf", json=data)
+    assert response.json()["value"] > 0.0
+
+
 @pytest.mark.timeout(30)
 def test_post_calculate_diversity_of_none_agents():
     """Test calculate diversity of none agents"""
@@ -165,6 +233,75 @@ def test_post_calculate_similarity_of_none_attributes():
     assert response.json() == {"similarities":[]}
 
 
+@pytest.mark.timeout(30)
+def test_post_calculate_similarity_of_top_k():
+    """Test obtain only the most similar attributes"""
+    data = {
+        "source":"Do you have a bike?",
+        "attributes":["materials.bi-plane", "materials.sportiveCar", "materials.undefined_vehicle" ],
+        "topK":1
+        }
+    response = client.post("/calculateSimilarityOf", json=data)
+    assert response.status_code == 200
+    assert response.json() == {"similarities":[{"attribute":"materials.sportiveCar", "similarity":0.6239031848677311}]}
+
+
+@pytest.mark.timeout(30)
+def test_post_calculate_similarity_of_min_similarity():
+    """Test obtain only the attributes with a minimum similarity"""
+    data = {
+        "source":"Do you have a bike?",
+        "attributes":["materials.bi-plane", "materials.sportiveCar", "materials.undefined_vehicle" ],
+        "minSimilarity":0.5
+        }
+    response = client.post("/calculateSimilarityOf", json=data)
+    assert response.status_code == 200
+    assert response.json() == {"similarities":[{"attribute":"materials.sportiveCar", "similarity":0.6239031848677311}, {"attribute":"materials.undefined_vehicle", "similarity":0.6239031848677311}]}
+
+
+@pytest.mark.timeout(120)
+def test_post_calculate_profiles_affinity():
+    """Test calculate the affinity between some profiles"""
+    data = {
+        "profiles":[
+            {"id":"1", "attributes":{"occupation":"app developer", "hobby":"climbing"}},
+            {"id":"2", "attributes":{"occupation":"teacher", "hobby":"running"}},
+            {"id":"3"}
+            ]
+        }
+    response = client.post("/calculateProfilesAffinity", json=data)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["profiles"] == ["1", "2", "3"]
+    affinities = np.array(body["affinities"])
+    assert affinities.shape == (3, 3)
+    assert (affinities == affinities.T).all()
+    assert ((0.0 <= affinities) & (affinities <= 1.0)).all()
+    assert (affinities[2] == 0.0).all()
+
+
+@pytest.mark.timeout(30)
+def test_post_calculate_similarity_of_stream():
+    """Test the similarity of some attributes returned as JSON lines"""
+    data = {
+        "source":"Do you have a bike?",
+        "attributes":["materials.sportiveCar", "materials.bi-plane", "materials.undefined_vehicle" ]
+        }
+    response = client.post("/calculateSimilarityOfStream", json=data)
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith("application/x-ndjson")
+    similarities = [json.loads(line) for line in response.text.splitlines()]
+    assert similarities == client.post("/calculateSimilarityOf", json=data).json()['similarities']
+
+
+@pytest.mark.timeout(30)
+def test_post_calculate_similarity_of_stream_none_attributes():
+    """Test the similarity stream without attributes"""
+    response = client.post("/calculateSimilarityOfStream", json={"source":"Do you have a bike?"})
+    assert response.status_code == 200
+    assert response.text == ""
+
+
 @pytest.mark.timeout(30)
 def test_post_calculate_similarity_of_empty_json_fail():
     """Test similarity with empty json fail"""
@@ -371,3 +508,90 @@ def test_post_calculate_diversity_for_domain_studying_career_4():
     response = client.post("/calculateDiversityOf", json=data)
     assert response.status_code == 200
     assert response.json() == {"value":0.375}
+
+
+@pytest.mark.timeout(30)
+def test_post_calculate_diversity_of_batch():
+    """Test calculate diversity of some teams formed from a set of agents"""
+    data = {
+        "agents":[
+                {
+                    "id":"1",
+                    "quantitativeAttributes":{
+                            "introvert":1.0,
+                            "extrovert":1.0,
+                            "naturalist":1.0
+                    },
+                    "qualitativeAttributes":{
+                            "gender":"M",
+                            "civilStatus":"married"
+                    }
+                },
+                {
+                    "id":"2",
+                    "quantitativeAttributes":{
+                            "introvert":0.0,
+                            "extrovert":0.0,
+                            "naturalist":0.0
+                    },
+                    "qualitativeAttributes":{
+                            "gender":"F",
+                            "civilStatus":"single"
+                    }
+                },
+                {
+                    "id":"3",
+                    "quantitativeAttributes":{
+                            "introvert":1.0,
+                            "extrovert":1.0,
+                            "naturalist":1.0
+                    },
+                    "qualitativeAttributes":{
+                            "gender":"M",
+                            "civilStatus":"married"
+                    }
+                }
+            ],
+        "qualitativeAttributes": {
+                "gender":["M", "F", "O"],
+                "civilStatus":["single", "married", "divorced", "widow"]
+            },
+        "quantitativeAttributes": ["introvert", "extrovert", "naturalist"],
+        "teams": [["1", "2"], ["1", "3"], ["1", "undefined"], []]
+        }
+    response = client.post("/calculateDiversityOfBatch", json=data)
+    assert response.status_code == 200
+    values = response.json()["values"]
+    assert len(values) == 4
+    assert abs(values[0] - 0.5261859507142914) < 1e-12
+    assert values[1] == 0.0
+    assert values[2] == 0.0
+    assert values[3] == 0.0
+
+
+@pytest.mark.timeout(30)
+def test_post_find_diverse_teams():
+    """Test search the most diverse teams of a set of agents"""
+    data = {
+        "agents":[
+                {"id":"1", "quantitativeAttributes":{"introvert":1.0}, "qualitativeAttributes":{"gender":"M"}},
+                {"id":"2", "quantitativeAttributes":{"introvert":0.0}, "qualitativeAttributes":{"gender":"F"}},
+                {"id":"3", "quantitativeAttributes":{"introvert":1.0}, "qualitativeAttributes":{"gender":"M"}},
+                {"id":"4", "quantitativeAttributes":{"introvert":0.9}, "qualitativeAttributes":{"gender":"M"}}
+            ],
+        "qualitativeAttributes": {
+                "gender":["M", "F", "O"]
+            },
+        "quantitativeAttributes": ["introvert"],
+        "teamSize": 2,
+        "maxTeams": 2,
+        "timeBudget": 1.0
+        }
+    response = client.post("/findDiverseTeams", json=data)
+    assert response.status_code == 200
+    teams = response.json()["teams"]
+    assert len(teams) == 2
+    assert sorted(teams[0]["agents"]) in (["1", "2"], ["2", "3"])
+    assert sorted(teams[1]["agents"]) in (["1", "2"], ["2", "3"])
+    assert teams[0]["diversity"] >= teams[1]["diversity"]
+    assert abs(teams[0]["diversity"] - (0.5 + np.log(2) / np.log(3)) / 2) < 1e-12
@@ -0,0 +1,80 @@
+#
+# Copyright 2019 - 2022 UDT-IA, IIIA-CSIC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import pytest
+import threading
+from resources import ResourceManager
+
+
+@pytest.mark.timeout(30)
+def test_resource_loaded_on_first_use():
+    """Test that a resource is loaded only the first time it is used"""
+    loads = []
+    resources = ResourceManager()
+    resources.register("model", lambda: loads.append(1) or "model")
+    assert not resources.is_loaded("model")
+    assert resources.stats() == {"model": {"instances": 0, "loadTime": None}}
+    assert resources.get("model") == "model"
+    assert resources.get("model") == "model"
+    assert len(loads) == 1
+    assert resources.stats()["model"]["instances"] == 1
+    assert resources.stats()["model"]["loadTime"] >= 0.0
+    with pytest.raises(KeyError):
+        resources.get("undefined")
+
+
+@pytest.mark.timeout(30)
+def test_preload_resources():
+    """Test preload some resources"""
+    resources = ResourceManager()
+    resources.register("a", lambda: "a")
+    resources.register("b", lambda: "b")
+    resources.register("c", lambda: "c")
+    resources.preload("")
+    assert not any(resources.is_loaded(name) for name in ["a", "b", "c"])
+    resources.preload("a, c")
+    assert resources.is_loaded("a") and not resources.is_loaded("b") and resources.is_loaded("c")
+    resources.preload("all")
+    assert resources.is_loaded("b")
+
+
+@pytest.mark.timeout(30)
+def test_resource_loaded_per_thread():
+    """Test that a resource loaded per thread is not shared between threads"""
+    resources = ResourceManager()
+    resources.register("lemmatizer", lambda: object(), per_thread=True)
+    instances = []
+    main = resources.get("lemmatizer")
+    thread = threading.Thread(target=lambda: instances.append(resources.get("lemmatizer")))
+    thread.start()
+    thread.join()
+    assert resources.get("lemmatizer") is main
+    assert instances[0] is not main
+    assert resources.stats()["lemmatizer"]["instances"] == 2
+
+
+@pytest.mark.timeout(30)
+def test_reload_resource():
+    """Test replace a resource with a new instance"""
+    resources = ResourceManager()
+    versions = iter(["v1", "v2"])
+    resources.register("scores", lambda: next(versions))
+    assert resources.get("scores") == "v1"
+    assert resources.reload("scores") == "v2"
+    assert resources.get("scores") == "v2"
+    assert resources.stats()["scores"]["instances"] == 2
+    with pytest.raises(KeyError):
+        resources.reload("undefined")
@@ -0,0 +1,93 @@
+#
+# Copyright 2019 - 2022 UDT-IA, IIIA-CSIC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import marshal
+import numpy as np
+import pytest
+from scores import ScoreStore, merge, migrate
+
+
+@pytest.mark.timeout(30)
+def test_score_store_from_dict():
+    """Test obtain the scores of a store created from a dictionary"""
+    store = ScoreStore.fromDict({
+        frozenset(["dog.n.01", "cat.n.01"]): 0.5,
+        frozenset(["dog.n.01"]): 1.0,
+        frozenset(["dog.n.01", "bike.n.01"]): None
+        })
+    assert len(store) == 3
+    assert store.get("dog.n.01", "cat.n.01") == 0.5
+    assert store.get("cat.n.01", "dog.n.01") == 0.5
+    assert store.get("dog.n.01", "dog.n.01") == 1.0
+    assert store.get("bike.n.01", "dog.n.01") == 0.0
+    assert store.get("cat.n.01", "cat.n.01") is None
+    assert store.get("undefined.n.01", "dog.n.01") is None
+    assert store.score(store.id("cat.n.01"), store.id("dog.n.01")) == 0.5
+
+
+@pytest.mark.timeout(30)
+def test_score_store_save_and_load(tmp_path):
+    """Test save a store and load it memory mapped"""
+    store = ScoreStore.fromDict({frozenset(["dog.n.01", "cat.n.01"]): 0.25, frozenset(["über.n.01", "cat.n.01"]): 0.75})
+    path = str(tmp_path / "scores.store")
+    store.save(path)
+    loaded = ScoreStore.load(path)
+    assert loaded.names == store.names
+    assert isinstance(loaded.values, np.memmap)
+    assert loaded.get("dog.n.01", "cat.n.01") == 0.25
+    assert loaded.get("cat.n.01", "über.n.01") == 0.75
+    ScoreStore().save(path)
+    assert len(ScoreStore.load(path)) == 0
+
+
+@pytest.mark.timeout(30)
+def test_migrate_marshal_scores(tmp_path):
+    """Test convert a scores marshal file to a store"""
+    marshal_path = str(tmp_path / "scores.marshal")
+    with open(marshal_path, "wb") as f:
+        marshal.dump({frozenset(["dog.n.01", "cat.n.01"]): 0.5}, f)
+    path = str(tmp_path / "scores.store")
+    migrate(marshal_path, path)
+    assert ScoreStore.load(path).get("cat.n.01", "dog.n.01") == 0.5
+
+
+@pytest.mark.timeout(30)
+def test_score_store_lookup():
+    """Test obtain the matrix of scores between some synsets"""
+    store = ScoreStore.fromDict({frozenset(["dog.n.01", "cat.n.01"]): 0.5, frozenset(["dog.n.01"]): 1.0})
+    sims = store.lookup(store.ids(["dog.n.01", "cat.n.01"]), store.ids(["dog.n.01", "undefined.n.01", "cat.n.01"]))
+    assert sims.shape == (2, 3)
+    assert sims[0, 0] == 1.0
+    assert sims[0, 2] == 0.5
+    assert sims[1, 0] == 0.5
+    assert np.isnan(sims[0, 1]) and np.isnan(sims[1, 1]) and np.isnan(sims[1, 2])
+    assert np.isnan(ScoreStore().lookup([0], [1])).all()
+
+
+@pytest.mark.timeout(30)
+def test_merge_score_stores():
+    """Test merge the scores of some stores"""
+    store1 = ScoreStore.fromDict({frozenset(["dog.n.01", "cat.n.01"]): 0.5, frozenset(["dog.n.01"]): 1.0})
+    store2 = ScoreStore.fromDict({frozenset(["ant.n.01", "dog.n.01"]): 0.25, frozenset(["dog.n.01", "cat.n.01"]): 0.75})
+    merged = merge([store1, store2])
+    assert merged.names == ["ant.n.01", "cat.n.01", "dog.n.01"]
+    assert len(merged) == 3
+    assert (np.diff(merged.keys) > 0).all()
+    assert merged.get("dog.n.01", "dog.n.01") == 1.0
+    assert merged.get("dog.n.01", "ant.n.01") == 0.25
+    assert merged.get("cat.n.01", "dog.n.01") == 0.75
+    assert merge([store2, store1]).get("cat.n.01", "dog.n.01") == 0.5
+    assert len(merge([ScoreStore(), ScoreStore()])) == 0
@@ -14,8 +14,11 @@
 # limitations under the License.
 #
 
+import numpy as np
 import pytest
-from WNS import sim_str_str, sim_str_str_multiling, sim_str_attrlst, sim_str_attrlst_multiling
+from scores import ScoreStore
+import WNS
+from WNS import attribute_synsets_cache, attribute_to_synsets, detect_lang, detect_langs, languages_cache, getLemmatizer, lemma_synsets_cache, lemmas_cache, path_score, path_score_matrix, sim_str_many, sim_str_str, sim_str_top, sim_str_iter, sim_str_str_multiling, sim_str_attrlst, sim_str_attrlst_multiling, sim_attrlst_attrlst, sim_attrlst_matrix, shards, similarity_bound, similarity_matrix, similarity_score, symetric_similarity_score, reachable_targets, text_to_synsets, tokLists_path_similarity, toks_to_synsets, transform_path_similarity
 
 
 @pytest.mark.timeout(30)
@@ -65,3 +68,241 @@ def test_sim_str_attrlst_multiling():
                 assert pair[1] == sim[1]
                 assert 0.0 <= sim[2] <= 1.0
                 break;
+
+
+@pytest.mark.timeout(30)
+def test_sim_str_attrlst_does_not_cache_attribute_synsets():
+    """Test that the pairs of a profile are not kept on the cache of the synsets of the attributes"""
+    pairs = [("occupation", "app developer"), ("hobby", "climbing")]
+    size = len(attribute_synsets_cache)
+    sims = sim_str_attrlst("I am testing this new application on my laptop.", pairs, lang1="en", lang2="en", stat="max")
+    assert len(attribute_synsets_cache) == size
+    for (key, value, sim), pair in zip(sims, pairs):
+        assert (key, value) == pair
+        assert sim == symetric_similarity_score(text_to_synsets("I am testing this new application on my laptop."), text_to_synsets(key + " : " + value), "max")
+
+
+@pytest.mark.timeout(30)
+def test_attribute_to_synsets_is_cached():
+    """Test that the synsets of an attribute are computed only once"""
+    synsets = attribute_to_synsets("sportive car", "en")
+    assert synsets == text_to_synsets("sportive car", "en")
+    hits = attribute_synsets_cache.hits
+    assert attribute_to_synsets("sportive car", "en") is synsets
+    assert attribute_synsets_cache.hits == hits + 1
+
+
+@pytest.mark.timeout(30)
+def test_sim_str_many():
+    """Test the similarity between a string and some others"""
+    targets = ["car", "plane", "vehicle"]
+    sims = sim_str_many("Do you have a bike?", targets, lang_src="en", lang_tgt="en", stat="max")
+    assert len(sims) == len(targets)
+    for target, sim in zip(targets, sims):
+        assert sim == sim_str_str("Do you have a bike?", target, lang1="en", lang2="en", stat="max")
+    assert sim_str_many("Do you have a bike?", []) == []
+
+
+@pytest.mark.timeout(30)
+def test_similarity_matrix():
+    """Test the scores between the synsets of two texts"""
+    synsets1 = text_to_synsets("Do you have a bike?", "en")
+    synsets2 = text_to_synsets("car vehicle", "en")
+    sims = similarity_matrix(synsets1, synsets2)
+    assert sims.shape == (len(synsets1), len(synsets2))
+    assert ((0.0 <= sims) & (sims <= 1.0)).all()
+    for stat in ["max", "mean", "q75", "q90"]:
+        sim = symetric_similarity_score(synsets1, synsets2, stat)
+        assert abs(sim - (similarity_score(synsets1, synsets2, stat) + similarity_score(synsets2, synsets1, stat)) / 2) < 1e-12
+    assert symetric_similarity_score(synsets1, [], "max") == 0
+
+
+def test_shards():
+    """Test the split of a list on consecutive parts"""
+    assert shards([1, 2, 3, 4, 5], 2) == [[1, 2, 3], [4, 5]]
+    assert shards([1, 2], 4) == [[1], [2]]
+    assert shards([], 3) == []
+
+
+@pytest.mark.timeout(120)
+def test_sim_str_many_on_process_pool(tmp_path, monkeypatch):
+    """Test that the similarities computed on a pool of processes are the same"""
+    targets = ["car", "plane", "vehicle", "bicycle"]
+    sims = sim_str_many("Do you have a bike?", targets, lang_src="en", lang_tgt="en", stat="max")
+    WNS.get_hypernyms().save(str(tmp_path / "hypernyms.index"))
+    monkeypatch.setenv("HYPERNYMS_PATH", str(tmp_path / "hypernyms.index"))
+    monkeypatch.setattr(WNS, "similarity_processes", 2)
+    monkeypatch.setattr(WNS, "process_pool", None)
+    # The requests with less targets than the minimum are computed on the calling thread
+    monkeypatch.setattr(WNS, "similarity_process_min_targets", len(targets) + 1)
+    assert sim_str_many("Do you have a bike?", targets, lang_src="en", lang_tgt="en", stat="max") == sims
+    assert WNS.process_pool is None
+    monkeypatch.setattr(WNS, "similarity_process_min_targets", len(targets))
+    try:
+        assert sim_str_many("Do you have a bike?", targets, lang_src="en", lang_tgt="en", stat="max") == sims
+        ranking = sorted(range(len(targets)), key=lambda i: (-sims[i], i))
+        assert sim_str_top("Do you have a bike?", targets, stat="max", top_k=2) == [(i, sims[i]) for i in ranking[:2]]
+    finally:
+        WNS.process_pool.shutdown()
+
+
+@pytest.mark.timeout(180)
+def test_reload_scores_recycles_process_pool(tmp_path, monkeypatch):
+    """Test that the pool of processes is replaced when the scores are reloaded, but the previous one is used until the computations using it end"""
+    WNS.get_hypernyms().save(str(tmp_path / "hypernyms.index"))
+    monkeypatch.setenv("HYPERNYMS_PATH", str(tmp_path / "hypernyms.index"))
+    monkeypatch.setattr(WNS, "similarity_processes", 1)
+    monkeypatch.setattr(WNS, "process_pool", None)
+    assert WNS.reload_scores(force=True)
+    assert WNS.process_pool is None
+    try:
+        with WNS.process_pool_in_use() as pool:
+            assert WNS.reload_scores(force=True)
+            assert WNS.process_pool is not pool
+            assert pool.submit(len, []).result() == 0
+        with pytest.raises(RuntimeError):
+            pool.submit(len, [])
+        assert WNS.process_pool_users == {}
+    finally:
+        WNS.process_pool.shutdown()
+
+
+@pytest.mark.timeout(30)
+def test_lemmas_and_synsets_are_cached():
+    """Test that the lemmas of a text and the synsets of a lemma are remembered"""
+    lemmatizer = getLemmatizer("en")
+    lemmas = lemmatizer.lemmatize("I like the red sportive cars")
+    hits = lemmas_cache.hits
+    assert lemmatizer.lemmatize("I like the red sportive cars") == lemmas
+    assert lemmas_cache.hits == hits + 1
+    synsets = toks_to_synsets(lemmas, lang="eng")
+    hits = lemma_synsets_cache.hits
+    assert toks_to_synsets(lemmas, lang="eng") == synsets
+    assert lemma_synsets_cache.hits == hits + len(lemmas)
+
+
+@pytest.mark.timeout(30)
+def test_similarity_bound():
+    """Test that the bound of the similarity is never lower than the similarity"""
+    synsets1 = text_to_synsets("Do you have a bike?", "en")
+    for text in ["car vehicle", "plane", "bike", "happy"]:
+        synsets2 = text_to_synsets(text, "en")
+        for stat in ["max", "mean", "q75", "q90"]:
+            assert similarity_bound(synsets1, synsets2, stat) >= symetric_similarity_score(synsets1, synsets2, stat)
+    assert similarity_bound(synsets1, [], "max") == 0
+
+
+@pytest.mark.timeout(30)
+def test_sim_str_top():
+    """Test obtain the most similar texts"""
+    source = "Do you have a bike?"
+    targets = ["plane", "car", "vehicle", "bike", "happy"]
+    sims = sim_str_many(source, targets, stat="mean")
+    ranking = sorted(range(len(targets)), key=lambda i: (-sims[i], i))
+    for top_k in [1, 2, 5, None]:
+        top = sim_str_top(source, targets, stat="mean", top_k=top_k)
+        assert top == [(i, sims[i]) for i in ranking[:top_k]]
+    top = sim_str_top(source, targets, stat="mean", min_similarity=0.5)
+    assert top == [(i, sims[i]) for i in ranking if sims[i] >= 0.5]
+    assert sim_str_top(source, [], top_k=3) == []
+
+
+@pytest.mark.timeout(60)
+def test_sim_str_top_skips_bounded_targets(monkeypatch):
+    """Test that the targets whose bound is lower than the top are not compared when their scores are precomputed"""
+    source = "Do you have a bike?"
+    targets = ["plane", "car", "vehicle", "bike", "happy"]
+    synsets = {s.name(): s for s in text_to_synsets(source) + [s for target in targets for s in attribute_to_synsets(target)]}
+    store = ScoreStore.fromDict({frozenset([a, b]): path_score(synsets[a], synsets[b]) for a in synsets for b in synsets if a < b})
+    previous = WNS.get_scores()
+    WNS.resources.set("scores", store)
+    try:
+        sims = sim_str_many(source, targets, stat="mean")
+        compared = []
+        score = WNS.symetric_similarity_score
+        monkeypatch.setattr(WNS, "symetric_similarity_score", lambda s1, s2, stat="max": compared.append(s2) or score(s1, s2, stat))
+        ranking = sorted(range(len(targets)), key=lambda i: (-sims[i], i))
+        assert sim_str_top(source, targets, stat="mean", top_k=1) == [(ranking[0], sims[ranking[0]])]
+        assert 0 < len(compared) < len(targets)
+    finally:
+        WNS.resources.set("scores", previous)
+
+
+@pytest.mark.timeout(120)
+def test_attribute_index(monkeypatch):
+    """Test that the registered attributes that are not reachable from the source are not compared, but their similarity is the same"""
+    monkeypatch.setattr(WNS, "attribute_index", None)
+    source = "Do you have a bike?"
+    targets = ["plane", "car", "vehicle", "bike", "happy", "dog", "wheel"]
+    sims = sim_str_many(source, targets, stat="mean")
+    WNS.warm_attribute_synsets(targets[:-1])
+    reachable = reachable_targets(text_to_synsets(source), targets)
+    assert not all(reachable) and reachable[3] and reachable[-1]
+    assert sim_str_many(source, targets, stat="mean") == sims
+    assert list(sim_str_iter(source, targets, stat="mean")) == sims
+    assert sim_str_top(source, targets, stat="mean", top_k=len(targets)) == sorted(enumerate(sims), key=lambda pair: (-pair[1], pair[0]))
+
+
+@pytest.mark.timeout(30)
+def test_path_score_matrix():
+    """Test that the scores computed with the index of hypernyms are the same as the ones of NLTK"""
+    synsets = text_to_synsets("Do you have a bike? I like to run in Paris with my dog", "en")
+    scores = path_score_matrix(synsets, synsets)
+    for i, s1 in enumerate(synsets):
+        for j, s2 in enumerate(synsets):
+            assert scores[i, j] == path_score(s1, s2)
+            assert scores[i, j] == transform_path_similarity(s1.path_similarity(s2))
+
+
+@pytest.mark.timeout(30)
+def test_detect_langs():
+    """Test detect the language of some texts at once"""
+    texts = ["Do you have a bike?", "I hate planes", "Do you have a bike?"]
+    langs = detect_langs(texts)
+    assert langs == [detect_lang(text) for text in texts]
+    hits = languages_cache.hits
+    assert detect_langs(texts) == langs
+    assert languages_cache.hits == hits + len(texts)
+    assert detect_langs([]) == []
+
+
+@pytest.mark.timeout(120)
+def test_sim_attrlst_matrix():
+    """Test the affinity between each pair of some profiles"""
+    profiles = [[("occupation", "app developer"), ("hobby", "climbing")], [("occupation", "teacher"), ("hobby", "running"), ("pet", "dog")], [], [("hobby", "climbing")]]
+    for stat in ["max", "mean", "q75", "q90"]:
+        affinities = sim_attrlst_matrix(profiles, langs=["en"] * len(profiles), stat=stat)
+        assert (affinities == affinities.T).all()
+        for i, profile1 in enumerate(profiles):
+            for j, profile2 in enumerate(profiles):
+                if len(profile1) == 0 or len(profile2) == 0:
+                    assert affinities[i, j] == 0.0
+                else:
+                    assert abs(affinities[i, j] - sim_attrlst_attrlst(profile1, profile2, "en", "en", stat)) < 1e-12
+    assert sim_attrlst_matrix([]).shape == (0, 0)
+
+
+@pytest.mark.timeout(30)
+def test_symmetric_synsets_similarity_matrix():
+    """Test that mirroring the blocks from the diagonal gives the same scores as computing all of them"""
+    synsets = text_to_synsets("I ride my bike to the city with my dog and my cat")
+    synsets = list({s.name(): s for s in synsets}.values())
+    expected = WNS.synsets_similarity_matrix(synsets, synsets)
+    for block in [1, 3, len(synsets)]:
+        assert np.allclose(WNS.symmetric_synsets_similarity_matrix(synsets, block), expected)
+
+
+@pytest.mark.timeout(30)
+def test_tokLists_path_similarity():
+    """Test the similarity between each pair of two lists of documents"""
+    tokLists1 = [["bike"], ["car", "vehicle"], [], ["plane"]]
+    tokLists2 = [["bicycle", "wheel"], ["happy"], ["vehicle"]]
+    sims = tokLists_path_similarity(tokLists1, tokLists2, "eng", "eng", "mean")
+    assert sims.shape == (4, 3)
+    for i, toks1 in enumerate(tokLists1):
+        for j, toks2 in enumerate(tokLists2):
+            expected = symetric_similarity_score(toks_to_synsets(toks1, lang="eng"), toks_to_synsets(toks2, lang="eng"), "mean")
+            assert abs(sims[i, j] - expected) < 1e-12
+    done = []
+    assert (tokLists_path_similarity(tokLists1, tokLists2, "eng", "eng", "mean", progress=done.append) == sims).all()
+    assert sum(done) == 12